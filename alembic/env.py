@@ -8,8 +8,11 @@ config = context.config
 target_metadata = Base.metadata
 
 async def run_migrations_online():
+    # Адрес БД можно переопределить для миграции шардов: alembic -x url=... upgrade head
+    url = context.get_x_argument(as_dictionary=True).get("url", config.get_main_option("sqlalchemy.url"))
+
     # Создаем асинхронный движок
-    connectable = create_async_engine(config.get_main_option("sqlalchemy.url"), echo=True)
+    connectable = create_async_engine(url, echo=True)
 
     # Создаем соединение с асинхронным движком
     async with connectable.connect() as connection:
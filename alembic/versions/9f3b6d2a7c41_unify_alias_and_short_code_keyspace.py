@@ -0,0 +1,55 @@
+"""Unify alias and short_code keyspace
+
+Revision ID: 9f3b6d2a7c41
+Revises: 2c942bb4e37f
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9f3b6d2a7c41'
+down_revision: Union[str, None] = '2c942bb4e37f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Раньше пользователи получали только сгенерированный short_code, алиасы не открывались,
+    # поэтому существующие коды не меняются. Алиас занимает место кода только там, где кода нет.
+    op.execute("""
+        UPDATE shortened_urls AS u
+        SET short_code = u.custom_alias
+        WHERE u.short_code IS NULL
+          AND u.custom_alias IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM shortened_urls AS o
+              WHERE o.short_code = u.custom_alias AND o.id <> u.id
+          )
+    """)
+    # Ссылки без кода и без свободного алиаса получают служебный код, чтобы short_code стал NOT NULL
+    op.execute("""
+        UPDATE shortened_urls
+        SET short_code = 'legacy-' || id
+        WHERE short_code IS NULL
+    """)
+    # Алиасы старых ссылок, отличающиеся от их кода, никогда не работали – сбрасываем их,
+    # иначе они заняли бы место в общем пространстве коротких кодов
+    op.execute("""
+        UPDATE shortened_urls
+        SET custom_alias = NULL
+        WHERE custom_alias IS NOT NULL AND short_code <> custom_alias
+    """)
+    # Уникальность обеспечивается одним индексом ix_shortened_urls_short_code
+    op.drop_constraint('shortened_urls_custom_alias_key', 'shortened_urls', type_='unique')
+    op.alter_column('shortened_urls', 'short_code', existing_type=sa.String(), nullable=False)
+
+
+def downgrade() -> None:
+    # Сброшенные алиасы не восстанавливаются
+    op.alter_column('shortened_urls', 'short_code', existing_type=sa.String(), nullable=True)
+    op.create_unique_constraint('shortened_urls_custom_alias_key', 'shortened_urls', ['custom_alias'])
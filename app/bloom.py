@@ -0,0 +1,324 @@
+from sqlalchemy.future import select
+from redis.exceptions import RedisError
+from dotenv import load_dotenv
+from typing import Iterable, List
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import time
+import uuid
+
+from .models import URLModel
+from .database import shard_sessionmakers
+from .cache import redis_client
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BLOOM_ENABLED = os.getenv("BLOOM_ENABLED", "true").lower() == "true"
+# memory | redis; при нескольких воркерах фильтр должен быть общим
+BLOOM_BACKEND = os.getenv(
+    "BLOOM_BACKEND", "redis" if int(os.getenv("WEB_CONCURRENCY", 1)) > 1 else "memory"
+)
+BLOOM_MEMORY_BYTES = int(os.getenv("BLOOM_MEMORY_BYTES", 16 * 1024 * 1024))  # Бюджет памяти под битовый массив
+BLOOM_EXPECTED_ITEMS = int(os.getenv("BLOOM_EXPECTED_ITEMS", 10_000_000))
+BLOOM_REBUILD_HOURS = int(os.getenv("BLOOM_REBUILD_HOURS", 6))
+BLOOM_MAX_HASHES = 10
+
+BLOOM_REDIS_KEY = "bloom:codes"
+BLOOM_CHANNEL = "bloom:added"  # Канал, через который процессы сообщают о новых кодах
+BLOOM_LOCK_KEY = "bloom:codes:lock"  # Общий фильтр в Redis строит только один процесс
+BLOOM_BUILT_AT_KEY = "bloom:codes:built_at"
+BLOOM_LOCK_SECONDS = 300  # Продлевается после каждой пачки кодов
+BLOOM_RETRY_SECONDS = 5
+BUILD_CHUNK_SIZE = 10000
+
+REDIS_ERRORS = (RedisError, OSError)
+
+# Снимаем блокировку, только если она всё ещё наша
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class LinkFilter:
+    """Фильтр Блума по коротким кодам (алиасы хранятся как короткие коды).
+
+    Отрицательный ответ означает, что кода точно нет в БД, и запрос можно
+    отклонить без обращения к БД и кэшу. Удалённые коды остаются в фильтре
+    до следующей перестройки.
+
+    Фильтр не должен отклонять существующие коды, поэтому при любых сомнениях
+    он пропускает запросы: пока нет подписки на новые коды, после её обрыва
+    (до завершения новой перестройки) и при ошибках Redis.
+    """
+
+    def __init__(self, memory_bytes: int, expected_items: int, backend: str = "memory"):
+        if backend not in ("memory", "redis"):
+            raise ValueError(f"Unknown BLOOM_BACKEND: {backend}. Use memory or redis.")
+        self.backend = backend
+        self.size = memory_bytes * 8
+        self.hashes = min(max(1, round(self.size / max(expected_items, 1) * math.log(2))), BLOOM_MAX_HASHES)
+        self.ready = False
+        self.items = 0
+        self._bits = bytearray(memory_bytes) if backend == "memory" else None
+        self._rebuilding = None
+        self._subscribed = False
+        self._epoch = 0  # Увеличивается при каждом обрыве подписки
+        self._pending_publish = []  # Коды, о которых не удалось оповестить остальные процессы
+        self._build_task = None
+        self._tasks = []
+        self.metrics = {"checks": 0, "rejected": 0, "passed": 0, "false_positives": 0, "rebuilds": 0, "errors": 0}
+
+    def _positions(self, code: str) -> List[int]:
+        digest = hashlib.blake2b(code.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    @staticmethod
+    def _set_bits(bits: bytearray, positions: Iterable[int]):
+        for pos in positions:
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    async def _add_local(self, codes: List[str], key: str = BLOOM_REDIS_KEY, bits: bytearray = None):
+        if self.backend == "memory":
+            for code in codes:
+                self._set_bits(bits if bits is not None else self._bits, self._positions(code))
+        else:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for code in codes:
+                    for pos in self._positions(code):
+                        pipe.setbit(key, pos, 1)
+                await pipe.execute()
+
+    async def add(self, *codes: str):
+        """Добавление новых кодов и уведомление остальных процессов"""
+        codes = [code for code in codes if code]
+        if not BLOOM_ENABLED or not codes:
+            return
+        try:
+            await self._receive(codes)
+        except REDIS_ERRORS:
+            # Ссылка уже создана; коды добавят получатели уведомления
+            logger.warning("Failed to add %d codes to the link filter", len(codes))
+        self._pending_publish.extend(codes)
+        await self._publish_pending()
+
+    async def _publish_pending(self):
+        """Оповещение остальных процессов; при ошибке коды ждут следующей попытки"""
+        if not self._pending_publish:
+            return
+        codes, self._pending_publish = self._pending_publish, []
+        try:
+            await redis_client.publish(BLOOM_CHANNEL, "\n".join(codes))
+        except REDIS_ERRORS:
+            self._pending_publish = codes + self._pending_publish
+            logger.warning("Failed to publish %d new codes, will retry", len(codes))
+
+    async def _receive(self, codes: List[str]):
+        await self._add_local(codes)
+        self.items += len(codes)
+        # Коды, добавленные во время перестройки, не должны потеряться после подмены
+        if self._rebuilding is not None:
+            self._rebuilding.extend(codes)
+
+    async def might_contain(self, code: str) -> bool:
+        """False – кода точно нет; True – код, возможно, существует"""
+        if not self.ready:
+            return True
+
+        self.metrics["checks"] += 1
+        positions = self._positions(code)
+        if self.backend == "memory":
+            found = all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in positions)
+        else:
+            try:
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    for pos in positions:
+                        pipe.getbit(BLOOM_REDIS_KEY, pos)
+                    found = all(await pipe.execute())
+            except REDIS_ERRORS:
+                self.metrics["errors"] += 1
+                return True
+
+        self.metrics["passed" if found else "rejected"] += 1
+        return found
+
+    def record_false_positive(self):
+        """Код прошёл фильтр, но не найден в БД"""
+        self.metrics["false_positives"] += 1
+
+    async def rebuild(self) -> bool:
+        """Построение фильтра заново потоковым чтением таблицы ссылок.
+
+        Возвращает False, если построение не выполнено: нет подписки на новые
+        коды (или она оборвалась во время построения), построение уже идёт или
+        общий фильтр в Redis сейчас строит другой процесс.
+        """
+        if not self._subscribed or self._rebuilding is not None:
+            return False
+        epoch = self._epoch
+
+        token = None
+        if self.backend == "redis":
+            token = uuid.uuid4().hex
+            if not await redis_client.set(BLOOM_LOCK_KEY, token, nx=True, ex=BLOOM_LOCK_SECONDS):
+                return False
+
+        self._rebuilding = []
+        bits = bytearray(len(self._bits)) if self.backend == "memory" else None
+        # У каждого построения свой временный ключ
+        tmp_key = f"{BLOOM_REDIS_KEY}:building:{token}"
+        items = 0
+
+        try:
+            if self.backend == "redis":
+                # Ключ создаётся сразу полного размера, в том числе для пустой таблицы
+                await redis_client.setbit(tmp_key, self.size - 1, 0)
+                await self._extend_build(token, tmp_key)
+
+            for session_factory in shard_sessionmakers:
+                async with session_factory() as db:
+                    async with db.begin():
+                        result = await db.stream(
+                            select(URLModel.short_code)
+                            .execution_options(yield_per=BUILD_CHUNK_SIZE)
+                        )
+                        async for partition in result.partitions():
+                            codes = [row.short_code for row in partition]
+                            await self._add_local(codes, key=tmp_key, bits=bits)
+                            items += len(codes)
+                            if token:
+                                await self._extend_build(token, tmp_key)
+
+            if self._epoch != epoch:
+                # Уведомления о новых кодах могли потеряться – такой фильтр не подменяем
+                logger.warning("Link filter subscription lost during rebuild, result discarded")
+                return False
+
+            # Подменяем фильтр целиком и досыпаем коды, пришедшие во время построения
+            if self.backend == "memory":
+                self._bits = bits
+            else:
+                async with redis_client.pipeline(transaction=True) as pipe:
+                    pipe.rename(tmp_key, BLOOM_REDIS_KEY)
+                    pipe.persist(BLOOM_REDIS_KEY)
+                    pipe.set(BLOOM_BUILT_AT_KEY, time.time())
+                    await pipe.execute()
+            added_during_build = self._rebuilding
+            self._rebuilding = None
+            await self._add_local(added_during_build)
+        finally:
+            self._rebuilding = None
+            if token:
+                await self._release_build(token, tmp_key)
+
+        self.items = items + len(added_during_build)
+        self.ready = True
+        self.metrics["rebuilds"] += 1
+        logger.info("Link filter rebuilt: %d codes, %d hashes, %d bits", self.items, self.hashes, self.size)
+        return True
+
+    async def _extend_build(self, token: str, tmp_key: str):
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.expire(BLOOM_LOCK_KEY, BLOOM_LOCK_SECONDS)
+            pipe.expire(tmp_key, BLOOM_LOCK_SECONDS)
+            await pipe.execute()
+
+    async def _release_build(self, token: str, tmp_key: str):
+        try:
+            await redis_client.delete(tmp_key)
+            await redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, BLOOM_LOCK_KEY, token)
+        except REDIS_ERRORS:
+            # Ключи удалятся сами по истечении BLOOM_LOCK_SECONDS
+            logger.warning("Failed to release link filter build lock")
+
+    async def _built_since(self, since: float) -> bool:
+        """Общий фильтр в Redis перестроен другим процессом не раньше since"""
+        built_at = await redis_client.get(BLOOM_BUILT_AT_KEY)
+        return built_at is not None and float(built_at) >= since
+
+    async def _build_until_ready(self, since: float):
+        """Повторяет построение, пока фильтр не будет готов; до этого запросы пропускаются"""
+        while True:
+            try:
+                if await self.rebuild():
+                    return
+                if self.backend == "redis" and await self._built_since(since):
+                    self.ready = True
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Без фильтра сервис продолжает работать, пропуская все запросы в БД
+                logger.exception("Link filter build failed, gate disabled")
+            await asyncio.sleep(BLOOM_RETRY_SECONDS)
+
+    async def _listen(self):
+        """Подписка на новые коды; после обрыва – переподписка и перестройка фильтра"""
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(BLOOM_CHANNEL)
+                self._subscribed = True
+                # Подписываемся до построения, чтобы не пропустить коды, созданные в процессе
+                self._build_task = asyncio.create_task(self._build_until_ready(time.time()))
+
+                while True:
+                    await self._publish_pending()
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=BLOOM_RETRY_SECONDS)
+                    if message is not None and message["type"] == "message":
+                        await self._receive(message["data"].decode("utf-8").split("\n"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("Link filter subscription lost (%s), gate disabled until rebuild", exc)
+            finally:
+                # Пропущенные уведомления означают ложные отрицательные ответы – выключаем фильтр
+                self._subscribed = False
+                self._epoch += 1
+                self.ready = False
+                if self._build_task is not None:
+                    self._build_task.cancel()
+                    self._build_task = None
+                try:
+                    await pubsub.reset()
+                except Exception:
+                    pass
+            await asyncio.sleep(BLOOM_RETRY_SECONDS)
+
+    async def start(self):
+        """Подписка на новые коды; первичное построение запускается после подписки"""
+        self._tasks = [asyncio.create_task(self._listen())]
+
+    async def stop(self):
+        for task in self._tasks + [self._build_task]:
+            if task is not None:
+                task.cancel()
+        self._tasks = []
+        self._build_task = None
+
+    def stats(self) -> dict:
+        estimated_fp_rate = (1 - math.exp(-self.hashes * self.items / self.size)) ** self.hashes
+        passed = self.metrics["passed"]
+        return {
+            "enabled": BLOOM_ENABLED,
+            "ready": self.ready,
+            "backend": self.backend,
+            "memory_bytes": self.size // 8,
+            "hashes": self.hashes,
+            "items": self.items,
+            "estimated_false_positive_rate": estimated_fp_rate,
+            "observed_false_positive_rate": self.metrics["false_positives"] / passed if passed else 0.0,
+            **self.metrics,
+        }
+
+
+link_filter = LinkFilter(BLOOM_MEMORY_BYTES, BLOOM_EXPECTED_ITEMS, BLOOM_BACKEND)
@@ -0,0 +1,107 @@
+from sqlalchemy.exc import OperationalError, InterfaceError, TimeoutError as PoolTimeoutError
+from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+import time
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DB_BREAKER_FAILURES = int(os.getenv("DB_BREAKER_FAILURES", 5))  # Подряд идущих сбоев до размыкания
+DB_BREAKER_RESET_SECONDS = float(os.getenv("DB_BREAKER_RESET_SECONDS", 10))  # Пауза до пробного запроса
+DB_CALL_TIMEOUT = float(os.getenv("DB_CALL_TIMEOUT", 2))  # Лимит времени операции с БД на пути перехода
+
+# Ошибки, которые означают недоступность БД, а не ошибку в запросе
+DB_UNAVAILABLE_ERRORS = (OSError, OperationalError, InterfaceError, PoolTimeoutError, asyncio.TimeoutError)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class DatabaseUnavailable(Exception):
+    """БД недоступна или предохранитель разомкнут"""
+
+
+class CircuitBreaker:
+    """Предохранитель для обращений к БД.
+
+    После DB_BREAKER_FAILURES сбоев подряд запросы к БД не выполняются
+    DB_BREAKER_RESET_SECONDS секунд; затем пропускается один пробный запрос,
+    успех которого снова замыкает предохранитель.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, call_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.call_timeout = call_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.metrics = {"calls": 0, "failures": 0, "timeouts": 0, "rejected": 0, "opened": 0}
+
+    def allow_request(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self._probe_in_flight = False
+        self.consecutive_failures = 0
+        if self.state != CLOSED:
+            logger.warning("Database circuit breaker closed")
+        self.state = CLOSED
+
+    def record_failure(self):
+        self._probe_in_flight = False
+        self.metrics["failures"] += 1
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.metrics["opened"] += 1
+                logger.warning("Database circuit breaker opened after %d failures", self.consecutive_failures)
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    async def call(self, coro_fn, *args, **kwargs):
+        """Вызов операции с БД с лимитом времени; при недоступности БД – DatabaseUnavailable"""
+        if not self.allow_request():
+            self.metrics["rejected"] += 1
+            raise DatabaseUnavailable("Database circuit breaker is open")
+
+        self.metrics["calls"] += 1
+        try:
+            result = await asyncio.wait_for(coro_fn(*args, **kwargs), self.call_timeout)
+        except asyncio.TimeoutError as e:
+            self.metrics["timeouts"] += 1
+            self.record_failure()
+            raise DatabaseUnavailable("Database call timed out") from e
+        except DB_UNAVAILABLE_ERRORS as e:
+            self.record_failure()
+            raise DatabaseUnavailable(str(e)) from e
+        except (asyncio.CancelledError, Exception):
+            # Ошибки уровня приложения (404, 410 и т.п.) не доказывают, что БД доступна:
+            # фильтр Блума отвечает 404 без запроса к БД. Пробный запрос просто повторится
+            self._probe_in_flight = False
+            raise
+
+        self.record_success()
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            **self.metrics,
+        }
+
+
+db_breaker = CircuitBreaker(DB_BREAKER_FAILURES, DB_BREAKER_RESET_SECONDS, DB_CALL_TIMEOUT)
@@ -1,12 +1,185 @@
 import redis.asyncio as redis
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from starlette.responses import Response
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.coder import Coder
+from fastapi_cache.decorator import cache
 from dotenv import load_dotenv
+from datetime import datetime
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+import orjson
+import struct
+import zlib
 import os
 
 load_dotenv()
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CACHE_PREFIX = "fastapi-cache"
+RESPONSE_BODY_NAMESPACE = "body"
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", 1024))  # Сжимаем значения больше порога
 
-redis_client = redis.from_url(REDIS_URL, encoding="utf8", decode_responses=True)
-FastAPICache.init(RedisBackend(redis_client), prefix="fastapi-cache")
+# Значения в кэше бинарные, поэтому ответы Redis не декодируются в строки
+redis_client = redis.from_url(REDIS_URL, decode_responses=False)
+
+# Первый байт значения – способ хранения
+_RAW = b"\x00"
+_ZLIB = b"\x01"
+
+
+def _compress(payload: bytes) -> bytes:
+    if len(payload) >= CACHE_COMPRESS_MIN_BYTES:
+        return _ZLIB + zlib.compress(payload)
+    return _RAW + payload
+
+
+def _decompress(value: bytes) -> bytes:
+    if value[:1] == _ZLIB:
+        return zlib.decompress(value[1:])
+    return value[1:]
+
+
+class ResponseBodyCoder(Coder):
+    """Хранит готовое JSON-тело ответа.
+
+    При попадании в кэш эндпоинт возвращает Response с сохранёнными байтами,
+    и ответ не проходит повторную валидацию и сериализацию.
+    """
+
+    @classmethod
+    def encode(cls, value: Any) -> bytes:
+        if isinstance(value, Response):
+            body = value.body
+        elif isinstance(value, BaseModel):
+            body = orjson.dumps(value.model_dump(mode="json"))
+        else:
+            body = orjson.dumps(jsonable_encoder(value))
+        return _compress(body)
+
+    @classmethod
+    def decode(cls, value: bytes) -> Response:
+        return Response(content=_decompress(value), media_type="application/json")
+
+    @classmethod
+    def decode_as_type(cls, value: bytes, *, type_: Any = None) -> Response:
+        # Готовый ответ не приводится к типу, объявленному у эндпоинта
+        return cls.decode(value)
+
+
+def response_body_key(func_name: str, params: Dict[str, Any]) -> str:
+    """Ключ кэша готового ответа: имя эндпоинта и его параметры пути и запроса"""
+    return f"{CACHE_PREFIX}:{RESPONSE_BODY_NAMESPACE}:{func_name}:{urlencode(sorted(params.items()))}"
+
+
+def _response_body_key_builder(func, namespace: str = "", *, request=None, response=None, args=(), kwargs=None) -> str:
+    # Зависимости (сессия БД и т.п.) в ключ не входят: их repr свой у каждого запроса
+    params = {
+        name: value for name, value in (kwargs or {}).items()
+        if value is None or isinstance(value, (str, int, float, bool))
+    }
+    return response_body_key(func.__name__, params)
+
+
+def cache_response_body(expire: int, after: Optional[Callable[..., None]] = None):
+    """Кэширование готового тела ответа эндпоинта (ResponseBodyCoder).
+
+    При попадании fastapi-cache пишет ETag, Cache-Control и статус кэша во внедрённый
+    Response, а FastAPI отдаёт возвращённый ответ – поэтому заголовки переносятся в него.
+    after вызывается с аргументами эндпоинта после каждого успешного ответа, в том числе из кэша.
+    """
+    def decorator(func):
+        cached = cache(
+            expire=expire, coder=ResponseBodyCoder,
+            namespace=RESPONSE_BODY_NAMESPACE, key_builder=_response_body_key_builder
+        )(func)
+
+        @wraps(cached)
+        async def inner(*args, **kwargs):
+            result = await cached(*args, **kwargs)
+            if after is not None:
+                after(**kwargs)
+            injected = next((value for value in kwargs.values() if isinstance(value, Response)), None)
+            if isinstance(result, Response) and injected is not None and result is not injected:
+                for name, value in injected.headers.items():
+                    if name not in ("content-length", "content-type"):
+                        result.headers[name] = value
+            return result
+
+        return inner
+    return decorator
+
+
+# Компактная запись для кэша переходов: флаги, срок действия (unix time, 0 – бессрочно), URL
+LINK_ENTRY_HEADER = struct.Struct("!Bq")
+
+LINK_FLAG_EXPIRES = 0x01
+
+
+def pack_link_entry(original_url: str, expires_at: Optional[datetime] = None, flags: int = 0) -> bytes:
+    """Упаковка записи ссылки в фиксированный бинарный формат"""
+    expires_ts = 0
+    if expires_at:
+        flags |= LINK_FLAG_EXPIRES
+        expires_ts = int((expires_at - datetime(1970, 1, 1)).total_seconds())
+    return LINK_ENTRY_HEADER.pack(flags, expires_ts) + original_url.encode("utf-8")
+
+
+def unpack_link_entry(value: bytes) -> Tuple[str, Optional[datetime], int]:
+    """Распаковка записи ссылки: (original_url, expires_at, flags)"""
+    flags, expires_ts = LINK_ENTRY_HEADER.unpack_from(value)
+    expires_at = datetime.utcfromtimestamp(expires_ts) if flags & LINK_FLAG_EXPIRES else None
+    return value[LINK_ENTRY_HEADER.size:].decode("utf-8"), expires_at, flags
+
+
+# Кэш записей ссылок для пакетного разрешения кодов
+LINK_CACHE_PREFIX = "link:"
+LINK_CACHE_TTL = int(os.getenv("LINK_CACHE_TTL", 300))
+# Долгоживущая копия записи для переходов, пока БД недоступна (возможно, устаревшая)
+LINK_STALE_PREFIX = "link-stale:"
+LINK_STALE_TTL = int(os.getenv("LINK_STALE_TTL", 7 * 24 * 3600))
+
+
+def _link_key(short_code: str, stale: bool = False) -> str:
+    return f"{LINK_STALE_PREFIX if stale else LINK_CACHE_PREFIX}{short_code}"
+
+
+async def get_cached_links(short_codes: List[str], stale: bool = False) -> Dict[str, Tuple[str, Optional[datetime], int]]:
+    """Чтение записей ссылок из кэша одним MGET; stale=True – из долгоживущих копий"""
+    if not short_codes:
+        return {}
+    values = await redis_client.mget([_link_key(code, stale) for code in short_codes])
+    return {
+        code: unpack_link_entry(value)
+        for code, value in zip(short_codes, values)
+        if value is not None
+    }
+
+
+async def cache_links(entries: Dict[str, Tuple[str, Optional[datetime]]]):
+    """Запись ссылок в кэш одним пайплайном"""
+    if not entries:
+        return
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for code, (original_url, expires_at) in entries.items():
+            entry = pack_link_entry(original_url, expires_at)
+            pipe.set(_link_key(code), entry, ex=LINK_CACHE_TTL)
+            # Долгоживущая копия пишется, только если её нет: при изменении ссылки её удаляет invalidate_link
+            pipe.set(_link_key(code, stale=True), entry, ex=LINK_STALE_TTL, nx=True)
+        await pipe.execute()
+
+
+async def invalidate_link(short_code: str):
+    """Удаление записи ссылки из кэша (вместе с долгоживущей копией и готовым ответом перехода)"""
+    await redis_client.delete(
+        _link_key(short_code),
+        _link_key(short_code, stale=True),
+        response_body_key("retrieve_url", {"short_code": short_code})
+    )
+
+
+def init_cache():
+    FastAPICache.init(RedisBackend(redis_client), prefix=CACHE_PREFIX, coder=ResponseBodyCoder)
@@ -0,0 +1,157 @@
+from collections import Counter
+from datetime import datetime
+from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+
+from sqlalchemy import update, func
+
+from .models import URLModel
+from .database import session_factory_for
+from .breaker import db_breaker, DatabaseUnavailable, CLOSED
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Максимум ссылок с незаписанными переходами; пока БД недоступна, буфер служит спулом
+CLICK_SPOOL_MAX_CODES = int(os.getenv("CLICK_SPOOL_MAX_CODES", 100_000))
+CLICK_FLUSH_CHUNK_SIZE = 500
+CLICK_SPOOL_REDIS_KEY = "clicks:spool"
+
+# Накопленные в памяти воркера переходы: short_code -> количество
+_pending_clicks: Counter = Counter()
+_last_accessed: dict = {}
+_flush_lock = None
+dropped_clicks = 0
+
+
+def record_click(short_code: str):
+    """Учитывает переход по ссылке без обращения к БД"""
+    global dropped_clicks
+    if short_code not in _pending_clicks and len(_pending_clicks) >= CLICK_SPOOL_MAX_CODES:
+        # Буфер заполнен (БД долго недоступна) – новые ссылки не учитываются
+        dropped_clicks += 1
+        return
+    _pending_clicks[short_code] += 1
+    _last_accessed[short_code] = datetime.utcnow()
+
+
+def spool_stats() -> dict:
+    """Состояние буфера переходов"""
+    return {
+        "pending_clicks": pending_count(),
+        "pending_links": len(_pending_clicks),
+        "max_links": CLICK_SPOOL_MAX_CODES,
+        "dropped_clicks": dropped_clicks,
+    }
+
+
+def pending_count() -> int:
+    """Количество переходов, ещё не записанных в БД"""
+    return sum(_pending_clicks.values())
+
+
+async def _flush_chunk(session_factory, counts: dict, accessed: dict):
+    async with session_factory() as db:
+        async with db.begin():
+            for short_code, count in counts.items():
+                await db.execute(
+                    update(URLModel)
+                    .where(URLModel.short_code == short_code)
+                    .values(
+                        clicks=func.coalesce(URLModel.clicks, 0) + count,
+                        last_accessed_at=accessed[short_code]
+                    )
+                )
+
+
+def _requeue(counts: dict, accessed: dict):
+    _pending_clicks.update(counts)
+    for short_code in counts:
+        _last_accessed.setdefault(short_code, accessed[short_code])
+
+
+async def flush_clicks():
+    """Записывает накопленные переходы в БД; пока БД недоступна, переходы остаются в буфере"""
+    global _flush_lock
+    if _flush_lock is None:
+        # Создаём лок внутри работающего event loop воркера
+        _flush_lock = asyncio.Lock()
+
+    async with _flush_lock:
+        # После восстановления БД дописываем и переходы, сохранённые в Redis
+        if db_breaker.state == CLOSED:
+            try:
+                await restore_from_redis()
+            except Exception:
+                logger.exception("Failed to restore spooled clicks from Redis")
+
+        if not _pending_clicks:
+            return 0
+
+        batch = dict(_pending_clicks)
+        accessed = dict(_last_accessed)
+        _pending_clicks.clear()
+        _last_accessed.clear()
+
+        # Каждый шард обновляется своими транзакциями, небольшими пачками,
+        # чтобы накопленный за время сбоя буфер укладывался в лимит времени запроса
+        by_shard = {}
+        for short_code, count in batch.items():
+            by_shard.setdefault(session_factory_for(short_code), {})[short_code] = count
+
+        flushed = 0
+        for factory, counts in by_shard.items():
+            items = list(counts.items())
+            for start in range(0, len(items), CLICK_FLUSH_CHUNK_SIZE):
+                chunk = dict(items[start:start + CLICK_FLUSH_CHUNK_SIZE])
+                try:
+                    await db_breaker.call(_flush_chunk, factory, chunk, accessed)
+                    flushed += len(chunk)
+                except DatabaseUnavailable:
+                    # Возвращаем переходы в буфер и повторим после восстановления БД
+                    _requeue(chunk, accessed)
+                except Exception:
+                    _requeue(chunk, accessed)
+                    logger.exception("Failed to flush %d click counters", len(chunk))
+
+        if flushed:
+            logger.info("Flushed clicks for %d links", flushed)
+        if flushed < len(batch):
+            logger.warning("Click counters kept in spool: %d links", len(batch) - flushed)
+        return flushed
+
+
+async def spool_to_redis():
+    """Перенос незаписанных переходов в Redis (при остановке воркера, пока БД недоступна)"""
+    from .cache import redis_client
+
+    if not _pending_clicks:
+        return
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for short_code, count in _pending_clicks.items():
+            pipe.hincrby(CLICK_SPOOL_REDIS_KEY, short_code, count)
+        await pipe.execute()
+    logger.warning("Spooled clicks for %d links to Redis", len(_pending_clicks))
+    _pending_clicks.clear()
+    _last_accessed.clear()
+
+
+async def restore_from_redis():
+    """Забирает переходы, сохранённые в Redis другими воркерами, в локальный буфер"""
+    from .cache import redis_client
+
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hgetall(CLICK_SPOOL_REDIS_KEY)
+        pipe.delete(CLICK_SPOOL_REDIS_KEY)
+        spooled, _ = await pipe.execute()
+
+    now = datetime.utcnow()
+    for short_code, count in spooled.items():
+        short_code = short_code.decode("utf-8")
+        _pending_clicks[short_code] += int(count)
+        _last_accessed.setdefault(short_code, now)
+    if spooled:
+        logger.info("Restored spooled clicks for %d links", len(spooled))
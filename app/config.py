@@ -6,4 +6,7 @@ load_dotenv()
 # Настройки для JWT
 SECRET_KEY = os.getenv("SECRET_KEY", "default-secret-key")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
\ No newline at end of file
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+
+# Токен для служебных эндпоинтов (/links/admin/...); если не задан, они отключены
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
\ No newline at end of file
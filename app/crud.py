@@ -1,6 +1,8 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import delete
+from sqlalchemy import delete, any_, bindparam, String
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import ARRAY
 from fastapi import HTTPException, status, Depends
 from datetime import datetime, timedelta
 from typing import Optional
@@ -11,32 +13,70 @@ from jose import jwt, JWTError
 from sqlalchemy.orm import Session
 from .models import URLModel, User
 from .config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
-from .database import get_db
+from .database import get_db, shard_session, scatter_gather, session_factory_for, shard_router
+from .bloom import link_filter
+from .outbox import (
+    record_event, record_events, EVENT_CREATED, EVENT_UPDATED, EVENT_DELETED, EVENT_PROJECT_CHANGED
+)
 
+import asyncio
 import logging
-logging.basicConfig()
-logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
+# Частые события перехода по ссылкам пишутся с семплированием (см. LOG_SAMPLE_RATES)
+redirect_logger = logging.getLogger("app.redirects")
 
 
 async def get_url(db: AsyncSession, short_code: str):
     """Получение URL по короткому коду без обновления статистики"""
-    async with db.begin():
-        result = await db.execute(select(URLModel).filter(URLModel.short_code == short_code))
-        url_entry = result.scalar_one_or_none()
+    # Заведомо несуществующие коды отклоняются без запроса к БД
+    if not await link_filter.might_contain(short_code):
+        raise HTTPException(status_code=404, detail="URL not found")
+
+    async with shard_session(db, short_code) as db:
+        async with db.begin():
+            result = await db.execute(select(URLModel).filter(URLModel.short_code == short_code))
+            url_entry = result.scalar_one_or_none()
 
-        if url_entry is None:
-            logger.error(f"URL entry not found for short_code: {short_code}")
-            raise HTTPException(status_code=404, detail="URL not found")
+            if url_entry is None:
+                link_filter.record_false_positive()
+                redirect_logger.info("URL entry not found for short_code: %s", short_code, extra={"short_code": short_code})
+                raise HTTPException(status_code=404, detail="URL not found")
 
-        if url_entry.expires_at and url_entry.expires_at < datetime.utcnow():
-            await delete_url(db, short_code)
-            raise HTTPException(status_code=410, detail="Link expired")
+            if url_entry.expires_at and url_entry.expires_at < datetime.utcnow():
+                await delete_url(db, short_code)
+                raise HTTPException(status_code=410, detail="Link expired")
 
     return url_entry
 
+async def get_urls_by_codes(db: AsyncSession, short_codes: list):
+    """Получение ссылок по списку коротких кодов без обновления статистики (один запрос на шард)"""
+    by_shard = {}
+    for code in short_codes:
+        by_shard.setdefault(session_factory_for(code), []).append(code)
+
+    async def query(session: AsyncSession, codes: list):
+        codes_param = bindparam("codes", value=codes, type_=ARRAY(String))
+        async with session.begin():
+            result = await session.execute(
+                select(URLModel.short_code, URLModel.original_url, URLModel.expires_at)
+                .filter(URLModel.short_code == any_(codes_param))
+            )
+            return result.all()
+
+    if shard_router is None:
+        return await query(db, list(short_codes))
+
+    async def run(factory, codes):
+        async with factory() as session:
+            return await query(session, codes)
+
+    results = await asyncio.gather(*(run(factory, codes) for factory, codes in by_shard.items()))
+    return [row for rows in results for row in rows]
+
+SHORT_CODE_ATTEMPTS = 5  # Попытки сгенерировать свободный короткий код
+
+
 async def create_url(
         db: AsyncSession,
         short_code: str,
@@ -45,7 +85,12 @@ async def create_url(
         expires_at: Optional[datetime] = None,
         project_name: Optional[str] = None
 ):
-    """Создание нового URL с кастомным алиасом, сроком действия и привязкой к проекту"""
+    """Создание нового URL с кастомным алиасом, сроком действия и привязкой к проекту.
+
+    Алиас и сгенерированные коды хранятся в одном столбце short_code, поэтому
+    уникальность проверяется одним ограничением при вставке. Если код занят,
+    возвращается None.
+    """
     new_url = URLModel(
         short_code=short_code,
         original_url=original_url,
@@ -56,101 +101,124 @@ async def create_url(
         clicks=0
     )
 
-    async with db.begin():
-        db.add(new_url)
-        await db.commit()
-        return new_url
+    async with shard_session(db, short_code) as db:
+        try:
+            async with db.begin():
+                db.add(new_url)
+                record_event(db, EVENT_CREATED, short_code, original_url, expires_at, project_name)
+        except IntegrityError:
+            logger.info("Short code already taken: %s", short_code)
+            return None
+
+    return new_url
 
 async def delete_url(db: AsyncSession, short_code: str):
     """Удаление URL по короткому коду"""
-    async with db.begin():
-        result = await db.execute(select(URLModel).filter(URLModel.short_code == short_code))
-        url_entry = result.scalar_one_or_none()
+    async with shard_session(db, short_code) as db:
+        async with db.begin():
+            result = await db.execute(select(URLModel).filter(URLModel.short_code == short_code))
+            url_entry = result.scalar_one_or_none()
 
-        if url_entry:
-            await db.delete(url_entry)
-            await db.commit()
-            return True
+            if url_entry:
+                await db.delete(url_entry)
+                record_event(db, EVENT_DELETED, short_code)
+                await db.commit()
+                return True
 
     return False
 
 async def update_url(db: AsyncSession, short_code: str, new_url: str):
     """Обновление оригинального URL по короткому коду"""
-    async with db.begin():
-        result = await db.execute(select(URLModel).filter(URLModel.short_code == short_code))
-        url_entry = result.scalar_one_or_none()
+    async with shard_session(db, short_code) as db:
+        async with db.begin():
+            result = await db.execute(select(URLModel).filter(URLModel.short_code == short_code))
+            url_entry = result.scalar_one_or_none()
 
-        if url_entry:
-            url_entry.original_url = new_url
-            await db.commit()
+            if url_entry:
+                url_entry.original_url = new_url
+                record_event(db, EVENT_UPDATED, short_code, new_url, url_entry.expires_at)
+                await db.commit()
 
-    if url_entry:
-        await db.refresh(url_entry)
+        if url_entry:
+            await db.refresh(url_entry)
 
     return url_entry
 
 async def get_url_stats(db: AsyncSession, short_code: str):
     """Получение статистики по короткому коду"""
-    async with db.begin():
-        result = await db.execute(select(URLModel).filter(URLModel.short_code == short_code))
-        url_entry = result.scalar_one_or_none()
+    async with shard_session(db, short_code) as db:
+        async with db.begin():
+            result = await db.execute(select(URLModel).filter(URLModel.short_code == short_code))
+            url_entry = result.scalar_one_or_none()
 
-        if not url_entry:
-            logger.error(f"URL entry not found for short_code: {short_code}")
-            raise HTTPException(status_code=404, detail="URL not found")
+            if not url_entry:
+                logger.error("URL entry not found for short_code: %s", short_code)
+                raise HTTPException(status_code=404, detail="URL not found")
 
-        return {
-            "short_code": url_entry.short_code,
-            "original_url": url_entry.original_url,
-            "created_at": url_entry.created_at.isoformat(),
-            "clicks": url_entry.clicks,
-            "last_accessed_at": url_entry.last_accessed_at.isoformat() if url_entry.last_accessed_at else None
-        }
+            return url_entry
 
 async def search_url(db: AsyncSession, original_url: str):
-    """Поиск ссылки по оригинальному URL"""
-    async with db.begin():
-        result = await db.execute(select(URLModel).filter(URLModel.original_url == original_url))
-        return result.scalar_one_or_none()
+    """Поиск ссылки по оригинальному URL (на всех шардах)"""
+    async def query(session: AsyncSession):
+        async with session.begin():
+            result = await session.execute(select(URLModel).filter(URLModel.original_url == original_url))
+            return result.scalar_one_or_none()
+
+    return next((url_entry for url_entry in await scatter_gather(db, query) if url_entry), None)
 
 async def update_project_name(db: AsyncSession, short_code: str, project_name: str):
     """Обновление проекта"""
-    async with db.begin():
-        result = await db.execute(select(URLModel).filter(URLModel.short_code == short_code))
-        url_entry = result.scalar_one_or_none()
+    async with shard_session(db, short_code) as db:
+        async with db.begin():
+            result = await db.execute(select(URLModel).filter(URLModel.short_code == short_code))
+            url_entry = result.scalar_one_or_none()
 
-        if not url_entry:
-            return None
+            if not url_entry:
+                return None
 
-        url_entry.project_name = project_name
-        await db.commit()
-        return url_entry
+            url_entry.project_name = project_name
+            record_event(db, EVENT_PROJECT_CHANGED, short_code, project_name=project_name)
+            await db.commit()
+            return url_entry
 
 async def get_links_by_project(db: AsyncSession, project_name: str):
-    """Получение ссылок по проекту"""
-    async with db.begin():
-        result = await db.execute(select(URLModel).filter(URLModel.project_name == project_name))
-        return result.scalars().all()
+    """Получение ссылок по проекту (со всех шардов)"""
+    async def query(session: AsyncSession):
+        async with session.begin():
+            result = await session.execute(select(URLModel).filter(URLModel.project_name == project_name))
+            return result.scalars().all()
+
+    return [link for links in await scatter_gather(db, query) for link in links]
 
 async def delete_unused_links(db: AsyncSession, days: int = 10):
     """Удаляет ссылки, которые не использовались более N дней"""
     threshold_date = datetime.utcnow() - timedelta(days=days)
-    async with db.begin():
-        await db.execute(
-            delete(URLModel).where(URLModel.last_accessed_at < threshold_date)
-        )
-        await db.commit()
+
+    async def query(session: AsyncSession):
+        async with session.begin():
+            result = await session.execute(
+                delete(URLModel)
+                .where(URLModel.last_accessed_at < threshold_date)
+                .returning(URLModel.short_code)
+            )
+            await record_events(session, EVENT_DELETED, result.scalars().all())
+
+    await scatter_gather(db, query)
 
 async def fetch_popular_links(db: AsyncSession):
-    """Получение 10 популярных ссылок"""
-    async with db.begin():
-        result = await db.execute(
-            select(URLModel)
-            .order_by(URLModel.clicks.desc().nulls_last())
-            .limit(10)
-        )
-        popular_links = result.scalars().all()
-        return popular_links
+    """Получение 10 популярных ссылок (топ каждого шарда объединяется)"""
+    async def query(session: AsyncSession):
+        async with session.begin():
+            result = await session.execute(
+                select(URLModel)
+                .order_by(URLModel.clicks.desc().nulls_last())
+                .limit(10)
+            )
+            return result.scalars().all()
+
+    links = [link for shard_links in await scatter_gather(db, query) for link in shard_links]
+    popular_links = sorted(links, key=lambda link: link.clicks or 0, reverse=True)[:10]
+    return popular_links
 
 async def get_user_by_username(db: AsyncSession, username: str):
     """Функция для получения пользователя из базы данных по имени пользователя"""
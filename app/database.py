@@ -1,19 +1,57 @@
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+import asyncio
 import os
 
+from .sharding import ShardRouter, parse_shards
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Шарды со ссылками «имя=адрес» через запятую; если не заданы, ссылки хранятся в DATABASE_URL.
+# Имена шардов задают кольцо и не должны меняться, адреса можно менять свободно
+DATABASE_SHARDS = parse_shards(os.getenv("DATABASE_SHARDS", ""))
+DATABASE_SHARD_URLS = [url for _, url in DATABASE_SHARDS]
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"  # Логирование SQL-запросов (только для отладки)
+
+# Размер пула на один процесс (gunicorn.conf.py делит общий лимит между воркерами)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+# Ограничения времени, чтобы запросы не зависали при проблемах с БД
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 5))  # Ожидание свободного соединения в пуле
+DB_QUERY_TIMEOUT = float(os.getenv("DB_QUERY_TIMEOUT", 10))  # Выполнение одного запроса
+
+
+def _create_engine(url):
+    return create_async_engine(
+        url,
+        echo=DB_ECHO,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=True,
+        connect_args={"command_timeout": DB_QUERY_TIMEOUT, "timeout": DB_POOL_TIMEOUT}
+    )
+
+
+def _create_sessionmaker(bind):
+    return sessionmaker(
+        bind=bind,
+        class_=AsyncSession,
+        expire_on_commit=False
+    )
+
+
+engine = _create_engine(DATABASE_URL)
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+AsyncSessionLocal = _create_sessionmaker(engine)
 
-AsyncSessionLocal = sessionmaker(
-    bind=engine,
-    class_=AsyncSession,
-    expire_on_commit=False
-)
+# Шарды со ссылками (пользователи всегда хранятся в основной БД)
+shard_router = ShardRouter([name for name, _ in DATABASE_SHARDS]) if DATABASE_SHARDS else None
+shard_engines = [_create_engine(url) for url in DATABASE_SHARD_URLS]
+shard_sessionmakers = [_create_sessionmaker(shard_engine) for shard_engine in shard_engines] or [AsyncSessionLocal]
 
 Base = declarative_base()
 
@@ -22,4 +60,33 @@ async def get_db():
         try:
             yield session
         finally:
-            await session.close()  # Закрываем сессию после использования
\ No newline at end of file
+            await session.close()  # Закрываем сессию после использования
+
+
+def session_factory_for(short_code: str):
+    """Фабрика сессий шарда, в котором хранится ссылка"""
+    if shard_router is None:
+        return AsyncSessionLocal
+    return shard_sessionmakers[shard_router.shard_for(short_code)]
+
+
+@asynccontextmanager
+async def shard_session(db: AsyncSession, short_code: str):
+    """Сессия для операции над одной ссылкой: без шардирования используется переданная сессия"""
+    if shard_router is None:
+        yield db
+        return
+    async with session_factory_for(short_code)() as session:
+        yield session
+
+
+async def scatter_gather(db: AsyncSession, query_fn):
+    """Параллельное выполнение запроса на всех шардах; возвращает список результатов по шардам"""
+    if shard_router is None:
+        return [await query_fn(db)]
+
+    async def run(factory):
+        async with factory() as session:
+            return await query_fn(session)
+
+    return await asyncio.gather(*(run(factory) for factory in shard_sessionmakers))
@@ -0,0 +1,41 @@
+"""Edge-режим: обслуживание переходов по снимку без БД.
+
+Запуск: gunicorn -c gunicorn.conf.py app.edge:app
+"""
+from fastapi import FastAPI, APIRouter, HTTPException
+from datetime import datetime
+
+from .logging_config import setup_logging
+from .snapshot import SnapshotResolver, SNAPSHOT_PATH
+
+setup_logging()
+
+router = APIRouter(prefix="/links", tags=["URL Shortener"])
+resolver = SnapshotResolver(SNAPSHOT_PATH)
+
+
+@router.get("/{short_code}")
+async def retrieve_url(short_code: str):
+    """Перенаправление на оригинальный URL по короткому коду (переходы не учитываются)"""
+    resolver.reload_if_changed()
+    entry = resolver.lookup(short_code)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="URL not found")
+
+    _, expires_at = entry
+    if expires_at and expires_at < datetime.utcnow():
+        raise HTTPException(status_code=410, detail="Link expired")
+
+    return {"message": "Redirect successful"}
+
+
+app = FastAPI()
+
+
+@app.on_event("startup")
+async def startup():
+    setup_logging()
+    resolver.load()
+
+
+app.include_router(router)
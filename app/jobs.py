@@ -0,0 +1,322 @@
+from celery import Celery, signals
+from celery.schedules import crontab
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.future import select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from dotenv import load_dotenv
+import redis as sync_redis
+import shortuuid
+import asyncio
+import csv
+import json
+import logging
+import os
+
+from .models import URLModel
+from .logging_config import setup_logging
+from .database import DATABASE_SHARD_URLS, shard_router
+from .tasks import delete_expired_links, delete_unused_links
+from .bloom import BLOOM_CHANNEL
+from .outbox import record_event, relay_events, EVENT_CREATED
+from .crud import SHORT_CODE_ATTEMPTS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", REDIS_URL)
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", REDIS_URL)
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+BULK_CHUNK_SIZE = 500  # Количество ссылок, вставляемых за одну транзакцию
+EXPORT_CHUNK_SIZE = 1000  # Количество строк, читаемых из БД за раз
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")  # Каталог выгрузок, общий для воркеров Celery и веб-воркеров
+STATS_ROLLUP_KEY = "stats:rollup"
+OUTBOX_RELAY_SECONDS = float(os.getenv("OUTBOX_RELAY_SECONDS", 2))
+OUTBOX_RELAY_MAX_BATCHES = 20
+
+celery_app = Celery(
+    "url_short_service",
+    broker=CELERY_BROKER_URL,
+    backend=CELERY_RESULT_BACKEND
+)
+celery_app.conf.update(
+    task_track_started=True,
+    result_expires=24 * 3600,
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    beat_schedule={
+        "cleanup-expired": {
+            "task": "app.jobs.cleanup_expired",
+            "schedule": crontab(minute=0),  # Раз в час
+        },
+        "cleanup-unused": {
+            "task": "app.jobs.cleanup_unused",
+            "schedule": crontab(minute=30, hour=3),  # Раз в сутки
+        },
+        "outbox-relay": {
+            "task": "app.jobs.relay_link_events",
+            "schedule": OUTBOX_RELAY_SECONDS,
+        },
+        "stats-rollup": {
+            "task": "app.jobs.rollup_stats",
+            "schedule": crontab(minute="*/15"),
+        },
+    },
+)
+
+@signals.setup_logging.connect
+def _configure_logging(**kwargs):
+    """Celery использует наше логирование (JSON, семплирование) вместо своего"""
+    setup_logging()
+
+
+@signals.worker_process_init.connect
+def _configure_worker_process_logging(**kwargs):
+    # Поток записи логов не переживает fork дочерних процессов пула
+    setup_logging()
+
+
+# Каждая задача запускается в своём event loop, поэтому соединения не переиспользуются
+def _worker_sessionmaker(url):
+    return sessionmaker(
+        bind=create_async_engine(url, poolclass=NullPool),
+        class_=AsyncSession,
+        expire_on_commit=False
+    )
+
+
+# По одной фабрике сессий на шард со ссылками (без шардирования – основная БД)
+worker_session_factories = [_worker_sessionmaker(url) for url in DATABASE_SHARD_URLS or [DATABASE_URL]]
+
+
+def run_with_session(session_factory, coro_fn, *args, **kwargs):
+    """Выполняет асинхронную функцию с отдельной сессией БД внутри задачи Celery"""
+    async def runner():
+        async with session_factory() as db:
+            return await coro_fn(db, *args, **kwargs)
+
+    return asyncio.run(runner())
+
+
+def run_on_shards(coro_fn, *args, **kwargs):
+    """Выполняет асинхронную функцию параллельно на всех шардах; возвращает список результатов"""
+    async def run(session_factory):
+        async with session_factory() as db:
+            return await coro_fn(db, *args, **kwargs)
+
+    async def runner():
+        return await asyncio.gather(*(run(factory) for factory in worker_session_factories))
+
+    return asyncio.run(runner())
+
+
+def _generate_code(shard: int) -> str:
+    """Случайный код, который попадает в тот же шард"""
+    while True:
+        short_code = shortuuid.ShortUUID().random(length=6)
+        if shard_router is None or shard_router.shard_for(short_code) == shard:
+            return short_code
+
+
+async def _insert_link(db: AsyncSession, shard: int, item: dict, project_name, now: datetime) -> Optional[str]:
+    """Вставка одной ссылки в точке сохранения; None, если код занят.
+
+    Занятый алиас не повторяется, для сгенерированного кода берётся новый код того же шарда.
+    """
+    alias = item.get("custom_alias")
+    short_code = item["short_code"]
+    for _ in range(1 if alias else SHORT_CODE_ATTEMPTS):
+        try:
+            async with db.begin_nested():
+                db.add(URLModel(
+                    short_code=short_code,
+                    original_url=item["url"],
+                    custom_alias=alias,
+                    project_name=project_name,
+                    last_accessed_at=now,
+                    clicks=0
+                ))
+                record_event(db, EVENT_CREATED, short_code, item["url"], project_name=project_name)
+            return short_code
+        except IntegrityError:
+            short_code = _generate_code(shard)
+    return None
+
+
+async def _bulk_shorten(db: AsyncSession, shard: int, items: list, project_name, on_chunk):
+    """Вставка ссылок одного шарда; коды назначены заранее.
+
+    Ошибка одной ссылки откатывает только её точку сохранения, а не всю пачку.
+    """
+    results = []
+    for start in range(0, len(items), BULK_CHUNK_SIZE):
+        chunk = items[start:start + BULK_CHUNK_SIZE]
+
+        async with db.begin():
+            now = datetime.utcnow()
+            created = []
+            for item in chunk:
+                short_code = await _insert_link(db, shard, item, project_name, now)
+                if short_code is None:
+                    error = "Custom alias already exists." if item.get("custom_alias") else "Could not generate a unique short code."
+                    results.append({"url": item["url"], "error": error})
+                    continue
+                results.append({"url": item["url"], "short_code": short_code})
+                created.append(short_code)
+
+        # Веб-воркеры добавят новые коды в свои фильтры
+        publish_codes(created)
+
+        on_chunk(len(chunk))
+
+    return results
+
+
+async def _export_links(db: AsyncSession, project_name, writer, on_rows):
+    query = select(
+        URLModel.short_code, URLModel.original_url, URLModel.custom_alias,
+        URLModel.project_name, URLModel.created_at, URLModel.expires_at, URLModel.clicks
+    ).order_by(URLModel.id)
+    if project_name:
+        query = query.filter(URLModel.project_name == project_name)
+
+    rows = 0
+    async with db.begin():
+        result = await db.stream(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        async for partition in result.partitions():
+            writer.writerows(partition)
+            rows += len(partition)
+            on_rows(len(partition))
+
+    return rows
+
+
+async def _rollup_stats(db: AsyncSession):
+    async with db.begin():
+        total_links, total_clicks = (await db.execute(
+            select(func.count(URLModel.id), func.coalesce(func.sum(URLModel.clicks), 0))
+        )).one()
+        projects = (await db.execute(
+            select(URLModel.project_name, func.count(URLModel.id), func.coalesce(func.sum(URLModel.clicks), 0))
+            .filter(URLModel.project_name.isnot(None))
+            .group_by(URLModel.project_name)
+        )).all()
+
+    return total_links, int(total_clicks), projects
+
+
+def publish_codes(codes: list):
+    """Уведомление веб-воркеров о созданных кодах"""
+    if codes:
+        sync_redis.from_url(REDIS_URL).publish(BLOOM_CHANNEL, "\n".join(codes))
+
+
+def _progress_reporter(task, total=None):
+    """Счётчик обработанных элементов, который отправляет прогресс задачи"""
+    done = 0
+
+    def progress(count):
+        nonlocal done
+        done += count
+        task.update_state(state="PROGRESS", meta={"done": done, "total": total})
+    return progress
+
+
+@celery_app.task(bind=True, name="app.jobs.bulk_shorten")
+def bulk_shorten(self, items: list, project_name: str = None):
+    """Массовое создание коротких ссылок"""
+    # Коды назначаются заранее, чтобы по ним определить шард
+    by_shard = {}
+    for item in items:
+        short_code = item.get("custom_alias") or shortuuid.ShortUUID().random(length=6)
+        shard = shard_router.shard_for(short_code) if shard_router else 0
+        by_shard.setdefault(shard, []).append({**item, "short_code": short_code})
+
+    progress = _progress_reporter(self, len(items))
+
+    async def run(shard, shard_items):
+        async with worker_session_factories[shard]() as db:
+            return await _bulk_shorten(db, shard, shard_items, project_name, progress)
+
+    async def runner():
+        return await asyncio.gather(*(run(shard, shard_items) for shard, shard_items in by_shard.items()))
+
+    results = [result for shard_results in asyncio.run(runner()) for result in shard_results]
+    logger.info("Bulk shorten finished: %d items", len(results))
+    return {"results": results}
+
+
+@celery_app.task(bind=True, name="app.jobs.export_links")
+def export_links(self, project_name: str = None):
+    """Выгрузка ссылок в CSV-файл (всех или одного проекта); в результате задачи – только путь к файлу"""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f"{self.request.id}.csv")
+    tmp_path = f"{path}.tmp"
+
+    progress = _progress_reporter(self)
+    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["short_code", "original_url", "custom_alias", "project_name",
+                         "created_at", "expires_at", "clicks"])
+        rows = sum(
+            run_with_session(factory, _export_links, project_name, writer, progress)
+            for factory in worker_session_factories
+        )
+    # Файл появляется под итоговым именем только целиком
+    os.replace(tmp_path, path)
+
+    logger.info("Export finished: %d rows -> %s", rows, path)
+    return {"rows": rows, "path": path}
+
+
+@celery_app.task(name="app.jobs.cleanup_expired")
+def cleanup_expired(batch_size: int = None):
+    """Пакетное удаление ссылок с истёкшим сроком действия"""
+    kwargs = {"batch_size": batch_size} if batch_size else {}
+    return {"deleted": sum(run_on_shards(delete_expired_links, **kwargs))}
+
+
+@celery_app.task(name="app.jobs.cleanup_unused")
+def cleanup_unused(batch_size: int = None):
+    """Пакетное удаление давно неиспользуемых ссылок"""
+    kwargs = {"batch_size": batch_size} if batch_size else {}
+    return {"deleted": sum(run_on_shards(delete_unused_links, **kwargs))}
+
+
+@celery_app.task(name="app.jobs.rollup_stats")
+def rollup_stats():
+    """Агрегация общей статистики; результат также сохраняется в Redis"""
+    stats = {"total_links": 0, "total_clicks": 0, "projects": {}}
+    for total_links, total_clicks, projects in run_on_shards(_rollup_stats):
+        stats["total_links"] += total_links
+        stats["total_clicks"] += total_clicks
+        for name, count, clicks in projects:
+            project = stats["projects"].setdefault(name, {"links": 0, "clicks": 0})
+            project["links"] += count
+            project["clicks"] += int(clicks)
+    stats["computed_at"] = datetime.utcnow().isoformat()
+
+    client = sync_redis.from_url(REDIS_URL)
+    client.set(STATS_ROLLUP_KEY, json.dumps(stats))
+    return stats
+
+
+@celery_app.task(name="app.jobs.relay_link_events", ignore_result=True)
+def relay_link_events():
+    """Публикация накопленных событий outbox в Redis stream"""
+    client = sync_redis.from_url(REDIS_URL)
+    total = 0
+    # Ограничиваем работу одного запуска, остаток заберёт следующий запуск по расписанию
+    for _ in range(OUTBOX_RELAY_MAX_BATCHES):
+        relayed = sum(run_on_shards(relay_events, client))
+        total += relayed
+        if relayed == 0:
+            break
+    return total
@@ -1,22 +1,77 @@
-from fastapi import FastAPI
-from fastapi_cache import FastAPICache
-from fastapi_cache.backends.redis import RedisBackend
-import redis.asyncio as redis
-import os
+from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
 
+from .logging_config import setup_logging, stop_logging
 from .routes import router
-from .tasks import start_scheduler
+from .cache import init_cache
+from .tasks import start_scheduler, stop_scheduler
+from .clicks import flush_clicks, spool_to_redis
+from .breaker import db_breaker, DatabaseUnavailable, DB_BREAKER_RESET_SECONDS
+from sqlalchemy.exc import OperationalError, InterfaceError, TimeoutError as PoolTimeoutError
+from .bloom import link_filter, BLOOM_ENABLED
+from .outbox import consume_cache_invalidations, remove_consumer
+from .profiler import loop_monitor
+import asyncio
+import logging
+import os
+import socket
 
-app = FastAPI()
+setup_logging()
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+app = FastAPI(default_response_class=ORJSONResponse)
+consumer_task = None
+consumer_name = None
 
 @app.on_event("startup")
 async def startup():
-    redis_client = redis.from_url(REDIS_URL, encoding="utf8", decode_responses=True)
-    FastAPICache.init(RedisBackend(redis_client), prefix="fastapi-cache")
+    # Повторный вызов запускает поток записи логов в воркере после fork
+    setup_logging()
+    init_cache()
+    loop_monitor.start()
+
+    # Фильтр несуществующих коротких кодов строится в фоне
+    if BLOOM_ENABLED:
+        await link_filter.start()
+
+    # Сброс кэша ссылок по событиям изменений, в том числе от фоновых задач
+    # Имя потребителя уникально в пределах всех контейнеров с веб-воркерами
+    global consumer_task, consumer_name
+    consumer_name = f"web-{socket.gethostname()}-{os.getpid()}"
+    consumer_task = asyncio.create_task(consume_cache_invalidations(consumer_name))
 
     # Запуск планировщика задач
     start_scheduler()
 
+@app.on_event("shutdown")
+async def shutdown():
+    # При остановке или перезапуске воркера сохраняем накопленные переходы
+    stop_scheduler()
+    loop_monitor.stop()
+    await link_filter.stop()
+    if consumer_task:
+        consumer_task.cancel()
+        await remove_consumer(consumer_name)
+    await flush_clicks()
+    # Если БД недоступна, переходы не теряются при перезапуске воркера
+    try:
+        await spool_to_redis()
+    except Exception:
+        logging.getLogger(__name__).exception("Failed to spool clicks to Redis")
+    stop_logging()
+
+@app.exception_handler(DatabaseUnavailable)
+async def database_unavailable_handler(request: Request, exc: DatabaseUnavailable):
+    return ORJSONResponse(
+        status_code=503,
+        content={"detail": "Database unavailable"},
+        headers={"Retry-After": str(int(DB_BREAKER_RESET_SECONDS))}
+    )
+
+# Сбои БД вне предохранителя тоже учитываются и возвращаются как 503
+for error in (OperationalError, InterfaceError, PoolTimeoutError):
+    @app.exception_handler(error)
+    async def database_error_handler(request: Request, exc: Exception):
+        db_breaker.record_failure()
+        return await database_unavailable_handler(request, DatabaseUnavailable(str(exc)))
+
 app.include_router(router)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, ForeignKey
 from sqlalchemy.orm import validates, relationship
 from datetime import datetime
 from .database import Base
@@ -37,9 +37,9 @@ class URLModel(Base):
     __tablename__ = "shortened_urls"
 
     id = Column(Integer, primary_key=True, index=True) # ID ссылки
-    short_code = Column(String, unique=True, index=True) # Короткая ссылка
+    short_code = Column(String, unique=True, index=True, nullable=False) # Короткая ссылка или кастомный alias
     original_url = Column(String, index=True, nullable=False) # Оригинальный URL
-    custom_alias = Column(String, unique=True, nullable=True)  # Кастомный alias
+    custom_alias = Column(String, nullable=True)  # Кастомный alias (совпадает с short_code, если задан)
     created_at = Column(DateTime, default=datetime.utcnow) # Дата создания ссылки
     expires_at = Column(DateTime, nullable=True)  # Время истечения срока жизни ссылки
     clicks = Column(Integer, default=0, index=True)  # Количество переходов
@@ -58,5 +58,18 @@ class URLModel(Base):
         return value
 
 
+class LinkEvent(Base):
+    """Событие изменения ссылки (outbox), записывается в одной транзакции с изменением"""
+    __tablename__ = "link_events"
+
+    id = Column(BigInteger, primary_key=True) # ID события, задаёт порядок публикации
+    event_type = Column(String(16), nullable=False) # created / updated / deleted / project_changed
+    short_code = Column(String, nullable=False) # Короткий код ссылки
+    original_url = Column(String, nullable=True) # Новый оригинальный URL
+    expires_at = Column(DateTime, nullable=True) # Срок действия ссылки
+    project_name = Column(String, nullable=True) # Новый проект
+    created_at = Column(DateTime, default=datetime.utcnow) # Время изменения
+
+
 class TokenRequest(BaseModel):
     token: Optional[str] = None
\ No newline at end of file
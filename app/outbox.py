@@ -0,0 +1,181 @@
+from sqlalchemy import delete, func, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from datetime import datetime
+from typing import Iterable, Optional
+import asyncio
+import logging
+import os
+
+from .models import LinkEvent
+
+logger = logging.getLogger(__name__)
+
+CHANGES_STREAM = "links:changes"
+CHANGES_STREAM_MAXLEN = int(os.getenv("CHANGES_STREAM_MAXLEN", 1_000_000))
+RELAY_BATCH_SIZE = int(os.getenv("OUTBOX_RELAY_BATCH_SIZE", 500))
+CACHE_CONSUMER_GROUP = "cache-invalidator"
+# Записи, не подтверждённые дольше этого времени, забираются у остановленных воркеров
+CONSUMER_CLAIM_IDLE_MS = int(os.getenv("CONSUMER_CLAIM_IDLE_MS", 60_000))
+CONSUMER_CLAIM_SECONDS = 30
+# Ключ advisory-блокировки: события публикует только один relay на шард
+RELAY_LOCK_KEY = 0x6C696E6B  # "link"
+
+EVENT_CREATED = "created"
+EVENT_UPDATED = "updated"
+EVENT_DELETED = "deleted"
+EVENT_PROJECT_CHANGED = "project_changed"
+
+
+def record_event(
+        db: AsyncSession,
+        event_type: str,
+        short_code: str,
+        original_url: Optional[str] = None,
+        expires_at: Optional[datetime] = None,
+        project_name: Optional[str] = None
+):
+    """Добавление события в outbox; сохраняется вместе с текущей транзакцией"""
+    db.add(LinkEvent(
+        event_type=event_type,
+        short_code=short_code,
+        original_url=original_url,
+        expires_at=expires_at,
+        project_name=project_name
+    ))
+
+
+async def record_events(db: AsyncSession, event_type: str, short_codes: Iterable[str]):
+    """Пакетная запись однотипных событий одним INSERT"""
+    rows = [{"event_type": event_type, "short_code": code, "created_at": datetime.utcnow()} for code in short_codes]
+    if rows:
+        await db.execute(insert(LinkEvent), rows)
+
+
+def _stream_fields(event: LinkEvent) -> dict:
+    fields = {"id": event.id, "type": event.event_type, "code": event.short_code}
+    if event.original_url is not None:
+        fields["url"] = event.original_url
+    if event.expires_at is not None:
+        fields["expires_at"] = event.expires_at.isoformat()
+    if event.project_name is not None:
+        fields["project"] = event.project_name
+    return fields
+
+
+async def relay_events(db: AsyncSession, redis_client, batch_size: int = RELAY_BATCH_SIZE) -> int:
+    """Публикация пачки событий из outbox в Redis stream.
+
+    Доставка «хотя бы один раз»: если транзакция не зафиксируется после публикации,
+    события будут опубликованы повторно, поэтому потребители должны быть идемпотентны.
+
+    Параллельные запуски публиковали бы события одного кода не по порядку, поэтому
+    пачку публикует только владелец advisory-блокировки, остальные сразу выходят.
+    """
+    async with db.begin():
+        if not await db.scalar(select(func.pg_try_advisory_xact_lock(RELAY_LOCK_KEY))):
+            return 0
+
+        events = (await db.execute(
+            select(LinkEvent)
+            .order_by(LinkEvent.id)
+            .limit(batch_size)
+        )).scalars().all()
+        if not events:
+            return 0
+
+        pipe = redis_client.pipeline(transaction=False)
+        for event in events:
+            pipe.xadd(CHANGES_STREAM, _stream_fields(event), maxlen=CHANGES_STREAM_MAXLEN, approximate=True)
+        pipe.execute()
+
+        await db.execute(delete(LinkEvent).where(LinkEvent.id.in_([event.id for event in events])))
+
+    logger.info("Relayed %d link events", len(events))
+    return len(events)
+
+
+async def _apply_invalidations(redis_client, messages):
+    from .cache import invalidate_link
+
+    for message_id, fields in messages:
+        if fields.get(b"type") in (EVENT_UPDATED.encode(), EVENT_DELETED.encode()):
+            await invalidate_link(fields[b"code"].decode("utf-8"))
+        await redis_client.xack(CHANGES_STREAM, CACHE_CONSUMER_GROUP, message_id)
+
+
+async def _claim_stale(redis_client, consumer_name: str):
+    """Обработка записей, зависших у остановленных воркеров, и удаление их потребителей из группы"""
+    start_id = "0-0"
+    while True:
+        # В Redis 7 ответ содержит третий элемент – удалённые из потока записи
+        response = await redis_client.xautoclaim(
+            CHANGES_STREAM, CACHE_CONSUMER_GROUP, consumer_name,
+            min_idle_time=CONSUMER_CLAIM_IDLE_MS, start_id=start_id, count=100
+        )
+        start_id, messages = response[0], response[1]
+        await _apply_invalidations(redis_client, messages)
+        if start_id in (b"0-0", "0-0"):
+            break
+
+    for consumer in await redis_client.xinfo_consumers(CHANGES_STREAM, CACHE_CONSUMER_GROUP):
+        name = consumer["name"]
+        name = name.decode("utf-8") if isinstance(name, bytes) else name
+        if name != consumer_name and consumer["pending"] == 0 and consumer["idle"] > CONSUMER_CLAIM_IDLE_MS:
+            await redis_client.xgroup_delconsumer(CHANGES_STREAM, CACHE_CONSUMER_GROUP, name)
+            logger.info("Removed idle change stream consumer %s", name)
+
+
+async def consume_cache_invalidations(consumer_name: str):
+    """Сброс кэша ссылок по событиям из stream (одна группа на все веб-воркеры)"""
+    from redis.exceptions import ResponseError
+    from .cache import redis_client
+
+    group_ready = False
+    claimed_at = 0.0
+    while True:
+        try:
+            # Группа создаётся заново и после недоступности Redis, и после потери потока (NOGROUP)
+            if not group_ready:
+                try:
+                    await redis_client.xgroup_create(CHANGES_STREAM, CACHE_CONSUMER_GROUP, id="$", mkstream=True)
+                except ResponseError as e:
+                    if "BUSYGROUP" not in str(e):  # Иначе группа уже создана другим воркером
+                        raise
+                group_ready = True
+
+            now = asyncio.get_running_loop().time()
+            if now - claimed_at >= CONSUMER_CLAIM_SECONDS:
+                claimed_at = now
+                await _claim_stale(redis_client, consumer_name)
+
+            response = await redis_client.xreadgroup(
+                CACHE_CONSUMER_GROUP, consumer_name, {CHANGES_STREAM: ">"}, count=100, block=5000
+            )
+            for _, messages in response or []:
+                await _apply_invalidations(redis_client, messages)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if isinstance(e, ResponseError) and "NOGROUP" in str(e):
+                group_ready = False  # Поток или группа удалены
+            logger.exception("Link change consumer failed, retrying")
+            await asyncio.sleep(1)
+
+
+async def remove_consumer(consumer_name: str):
+    """Удаление потребителя при остановке воркера.
+
+    Неподтверждённые записи удалились бы вместе с потребителем, поэтому в этом
+    случае он остаётся в группе: записи заберёт и затем удалит другой воркер.
+    """
+    from .cache import redis_client
+
+    try:
+        for consumer in await redis_client.xinfo_consumers(CHANGES_STREAM, CACHE_CONSUMER_GROUP):
+            name = consumer["name"]
+            name = name.decode("utf-8") if isinstance(name, bytes) else name
+            if name == consumer_name and consumer["pending"] == 0:
+                await redis_client.xgroup_delconsumer(CHANGES_STREAM, CACHE_CONSUMER_GROUP, consumer_name)
+    except Exception:
+        logger.exception("Failed to remove change stream consumer %s", consumer_name)
@@ -0,0 +1,172 @@
+"""Семплирующий профилировщик и монитор задержек event loop для работающего воркера.
+
+Снятие профиля с воркера:
+    python -m app.profiler --url http://localhost:8000 --seconds 10 --token ADMIN_TOKEN -o profile.folded
+Результат – свёрнутые стеки (collapsed stacks), из которых строится flamegraph (flamegraph.pl, speedscope).
+"""
+from collections import Counter, deque
+from datetime import datetime
+from dotenv import load_dotenv
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import urllib.request
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", 5))
+PROFILER_MAX_SECONDS = int(os.getenv("PROFILER_MAX_SECONDS", 60))
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", 100))
+LOOP_LAG_INTERVAL_MS = float(os.getenv("LOOP_LAG_INTERVAL_MS", 50))
+LOOP_LAG_MAX_EVENTS = 100
+
+
+def _collapse(frame) -> str:
+    """Стек потока в формате collapsed: корень;...;вершина"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Снимает стек потока event loop из отдельного потока с заданным интервалом.
+
+    Профилируемый код не инструментируется, поэтому накладные расходы
+    ограничены чтением стека раз в интервал. Одновременно работает один профиль.
+    """
+
+    def __init__(self, interval_ms: float = PROFILER_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self._lock = threading.Lock()
+
+    def _sample(self, thread_id: int, stop: threading.Event, stacks: Counter):
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stacks[_collapse(frame)] += 1
+
+    async def profile(self, seconds: float) -> str:
+        """Профиль потока текущего event loop за seconds секунд в формате collapsed stacks"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("Profiler is already running")
+
+        stacks = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample, args=(threading.get_ident(), stop, stacks), daemon=True
+        )
+        try:
+            sampler.start()
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            sampler.join()
+            self._lock.release()
+
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class LoopLagMonitor:
+    """Отслеживает блокировки event loop.
+
+    Корутина в loop регулярно обновляет отметку времени; сторожевой поток,
+    заметив, что отметка не обновлялась дольше порога, сохраняет стек потока
+    loop – то есть код, который его сейчас блокирует.
+    """
+
+    def __init__(self, threshold_ms: float = LOOP_LAG_THRESHOLD_MS, interval_ms: float = LOOP_LAG_INTERVAL_MS):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.events = deque(maxlen=LOOP_LAG_MAX_EVENTS)
+        self.max_lag_ms = 0.0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._stop = threading.Event()
+        self._task = None
+        self._watchdog = None
+
+    async def _beat(self):
+        while True:
+            started = time.monotonic()
+            self._heartbeat = started
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - started - self.interval
+            self.max_lag_ms = max(self.max_lag_ms, lag * 1000)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.interval):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat
+            # Один стек на одну блокировку
+            if blocked > self.threshold + self.interval and reported != heartbeat:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                self.events.append({
+                    "at": datetime.utcnow().isoformat(),
+                    "blocked_ms": round(blocked * 1000, 1),
+                    "stack": "".join(traceback.format_stack(frame)) if frame is not None else None,
+                })
+                reported = heartbeat
+                logger.warning("Event loop blocked for %.0f ms", blocked * 1000)
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._beat())
+        self._watchdog = threading.Thread(target=self._watch, daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "threshold_ms": self.threshold * 1000,
+            "max_lag_ms": round(self.max_lag_ms, 1),
+            "slow_events": list(self.events),
+        }
+
+
+profiler = SamplingProfiler()
+loop_monitor = LoopLagMonitor()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Снятие профиля с работающего воркера")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--seconds", type=int, default=10)
+    parser.add_argument("--token", default=os.getenv("ADMIN_TOKEN"))
+    parser.add_argument("-o", "--output", default="profile.folded")
+    args = parser.parse_args(argv)
+
+    request = urllib.request.Request(
+        f"{args.url}/links/admin/profile?seconds={args.seconds}",
+        method="POST",
+        headers={"X-Admin-Token": args.token or ""},
+    )
+    with urllib.request.urlopen(request, timeout=args.seconds + 30) as response:
+        data = response.read()
+        pid = response.headers.get("X-Worker-Pid")
+
+    with open(args.output, "wb") as f:
+        f.write(data)
+    print(f"Profile of worker {pid} saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
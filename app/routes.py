@@ -1,29 +1,42 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
-from sqlalchemy.future import select
+from fastapi import APIRouter, HTTPException, Depends, Query, Header
+from fastapi.responses import PlainTextResponse, FileResponse
+import os
+import secrets
 import shortuuid
-from fastapi_cache.decorator import cache
-from fastapi_cache import FastAPICache
-from typing import Optional
+from typing import List, Optional
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from passlib.context import CryptContext
 from datetime import datetime
 from sqlalchemy.ext.asyncio import AsyncSession
+from redis.exceptions import RedisError
+from pydantic import EmailStr
 
 
 from .database import get_db
-from .schemas import URLCreate
+from .schemas import (
+    URLCreate, BulkShortenRequest, ResolveRequest, User as UserOut, Token, Message, LinkInfo,
+    ShortenedLink, LinkStats, PopularLinks, ProjectUpdate, ResolvedLink, ResolveResponse,
+    FilterMetrics, LoopLagStats, JobStarted, JobsStarted, JobStatus, DBHealth
+)
 from .crud import (
+    SHORT_CODE_ATTEMPTS,
     get_url, create_url, delete_url, update_url, get_url_stats, search_url,
-    update_project_name, get_links_by_project, fetch_popular_links,
+    update_project_name, get_links_by_project, fetch_popular_links, get_urls_by_codes,
     get_user_by_username, get_user, create_access_token, verify_password
 )
 from .utils import hash_password
-from .models import URLModel, User
+from .clicks import record_click, spool_stats
+from .breaker import db_breaker, DatabaseUnavailable
+from .cache import get_cached_links, cache_links, invalidate_link, cache_response_body
+from .bloom import link_filter
+from .profiler import profiler, loop_monitor, PROFILER_MAX_SECONDS
+from .config import ADMIN_TOKEN
+from .jobs import celery_app, bulk_shorten, export_links, cleanup_expired, cleanup_unused, rollup_stats
+from .models import User
 
 
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/links", tags=["URL Shortener"])
@@ -32,9 +45,9 @@ router = APIRouter(prefix="/links", tags=["URL Shortener"])
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/links/token")
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-
-@router.post("/register")
-async def register_user(username: str, email: str, password: str, db: AsyncSession = Depends(get_db)):
+@router.post("/register", response_model=UserOut)
+async def register_user(username: str, email: EmailStr, password: str, db: AsyncSession = Depends(get_db)):
+    # Почта проверяется той же схемой, что и в ответе UserOut: иначе ответ не прошёл бы валидацию после сохранения
     db_user = await get_user_by_username(db, username=username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
@@ -46,20 +59,20 @@ async def register_user(username: str, email: str, password: str, db: AsyncSessi
     await db.commit()
     await db.refresh(new_user)
 
-    logger.info(f"User registered: {new_user.username}, Email: {new_user.email}")
+    logger.info("User registered: %s", new_user.username, extra={"user_id": new_user.id})
 
     return new_user
 
-@router.post("/token")
+@router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     user = await get_user(db, form_data.username)
     if not user or not await verify_password(form_data.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     access_token = create_access_token(data={"sub": user.username})
-    return {"access_token": access_token, "token_type": "bearer"}
+    return Token(access_token=access_token, token_type="bearer")
 
 
-@router.post("/shorten")
+@router.post("/shorten", response_model=ShortenedLink)
 async def shorten_url(
         url_data: URLCreate,
         db: AsyncSession = Depends(get_db),
@@ -67,7 +80,6 @@ async def shorten_url(
         project_name: Optional[str] = None
 ):
     """Создание короткой ссылки с возможностью указания времени жизни и проекта"""
-    short_code = shortuuid.ShortUUID().random(length=6)
     custom_alias = url_data.custom_alias
     expires_at_datetime = None
 
@@ -78,51 +90,51 @@ async def shorten_url(
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD HH:MM.")
 
-    # Проверка на уникальность custom_alias, если он указан
-    if custom_alias:
-        async with db.begin():
-            result = await db.execute(select(URLModel).filter(URLModel.custom_alias == custom_alias))
-            existing_alias = result.scalar_one_or_none()
-            if existing_alias:
-                raise HTTPException(status_code=400, detail="Custom alias already exists.")
-
-
-    new_url = await create_url(db, short_code, url_data.url, custom_alias, expires_at_datetime, project_name)
-    logger.info(f"Shortened URL created: {new_url.short_code} for {new_url.original_url}")
-
-    return {
-        "short_code": new_url.short_code,
-        "original_url": new_url.original_url,
-        "expires_at": new_url.expires_at,
-        "project_name": new_url.project_name
-    }
-
-    await db.commit()
-
-
-@router.delete("/{short_code}")
+    # Алиас используется как короткий код; уникальность проверяется при вставке
+    for _ in range(SHORT_CODE_ATTEMPTS):
+        short_code = custom_alias or shortuuid.ShortUUID().random(length=6)
+        new_url = await create_url(db, short_code, url_data.url, custom_alias, expires_at_datetime, project_name)
+        if new_url is not None:
+            break
+        if custom_alias:
+            raise HTTPException(status_code=400, detail="Custom alias already exists.")
+    else:
+        raise HTTPException(status_code=500, detail="Could not generate a unique short code.")
+
+    await link_filter.add(new_url.short_code)
+    logger.info("Shortened URL created: %s", new_url.short_code, extra={"original_url": new_url.original_url})
+
+    return ShortenedLink(
+        short_code=new_url.short_code,
+        original_url=new_url.original_url,
+        expires_at=new_url.expires_at,
+        project_name=new_url.project_name
+    )
+
+
+@router.delete("/{short_code}", response_model=Message)
 async def remove_url(short_code: str, db: AsyncSession = Depends(get_db)):
     """Удаление короткой связки короткой ссылки и url"""
-    url_entry = await get_url(db, short_code)
+    url_entry = await db_breaker.call(get_url, db, short_code)
     if url_entry is None:
         raise HTTPException(status_code=404, detail="URL not found")
 
-    logger.info(f"Attempting to delete URL: {url_entry.short_code}")
+    logger.info("Attempting to delete URL: %s", url_entry.short_code)
 
     if not await delete_url(db, short_code):
         raise HTTPException(status_code=404, detail="URL not found")
 
-    logger.info(f"Deleted URL: {url_entry.short_code}")
+    logger.info("Deleted URL: %s", url_entry.short_code)
 
-    FastAPICache.clear()
+    await invalidate_link(short_code)
 
-    return {"message": "URL deleted successfully"}
+    return Message(message="URL deleted successfully")
 
 
-@router.put("/{short_code}")
+@router.put("/{short_code}", response_model=LinkInfo)
 async def modify_url(short_code: str, new_url: str, db: AsyncSession = Depends(get_db)):
     """К короткой ссылке привязывается новая длинная ссылка"""
-    url_entry = await get_url(db, short_code)
+    url_entry = await db_breaker.call(get_url, db, short_code)
     if url_entry is None:
         raise HTTPException(status_code=404, detail="URL not found")
 
@@ -130,62 +142,161 @@ async def modify_url(short_code: str, new_url: str, db: AsyncSession = Depends(g
     if not updated_url:
         raise HTTPException(status_code=404, detail="URL not found")
 
-    FastAPICache.clear()
+    await invalidate_link(short_code)
+
+    return LinkInfo(
+        short_code=short_code,
+        original_url=updated_url.original_url,
+        expires_at=updated_url.expires_at
+    )
+
+@router.post("/resolve", response_model=ResolveResponse)
+async def resolve_urls(request: ResolveRequest, db: AsyncSession = Depends(get_db)):
+    """Пакетное получение оригинальных URL по коротким кодам без учёта переходов"""
+    codes = list(dict.fromkeys(request.codes))  # Убираем повторы, сохраняя порядок
+
+    # Без Redis все коды разрешаются одним запросом ANY(:codes)
+    try:
+        cached = await get_cached_links(codes)
+    except RedisError:
+        logger.warning("Link cache unavailable, resolving %d codes from the database", len(codes))
+        cached = {}
+    entries = {code: (url, expires_at) for code, (url, expires_at, _) in cached.items()}
+
+    misses = [code for code in codes if code not in entries]
+    if misses:
+        found = {row.short_code: (row.original_url, row.expires_at) for row in await get_urls_by_codes(db, misses)}
+        try:
+            await cache_links(found)
+        except RedisError:
+            logger.warning("Failed to cache %d resolved links", len(found))
+        entries.update(found)
 
-    return {
-        "short_code": short_code,
-        "original_url": updated_url.original_url,
-        "expires_at": updated_url.expires_at
-    }
+    now = datetime.utcnow()
+    results = []
+    for code in request.codes:
+        entry = entries.get(code)
+        if entry is None:
+            results.append(ResolvedLink(short_code=code, status="not_found"))
+            continue
 
-@router.get("/{short_code}")
-@cache(expire=60)  # Кэшируем ссылку на 60 секунд
-async def retrieve_url(short_code: str, db: AsyncSession = Depends(get_db)):
-    """Перенаправление на оригинальный URL по короткому коду"""
-    url_entry = await get_url(db, short_code)
-    if url_entry is None:
-        raise HTTPException(status_code=404, detail="Link not found")
+        original_url, expires_at = entry
+        results.append(ResolvedLink(
+            short_code=code,
+            status="expired" if expires_at and expires_at < now else "ok",
+            original_url=original_url,
+            expires_at=expires_at
+        ))
 
-    # Обновляем количество переходов по ссылке и время последнего доступа
-    url_entry.clicks += 1
-    url_entry.last_accessed_at = datetime.utcnow()
+    return ResolveResponse(results=results)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Доступ к служебным эндпоинтам только по ADMIN_TOKEN"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+@router.post("/admin/profile", dependencies=[Depends(require_admin)], response_class=PlainTextResponse)
+async def profile_worker(seconds: int = Query(10, ge=1, le=PROFILER_MAX_SECONDS)):
+    """Семплирующий профиль event loop воркера в формате collapsed stacks"""
+    try:
+        stacks = await profiler.profile(seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(stacks, headers={"X-Worker-Pid": str(os.getpid())})
 
-    await db.commit()
 
-    return {"message": "Redirect successful"}
+@router.get("/admin/loop_lag", dependencies=[Depends(require_admin)], response_model=LoopLagStats)
+async def get_loop_lag():
+    """Задержки event loop воркера и стеки блокирующего кода"""
+    return loop_monitor.stats()
 
 
-@router.get("/search/")
+@router.get("/filter/metrics", response_model=FilterMetrics)
+async def get_filter_metrics():
+    """Состояние фильтра Блума по коротким кодам"""
+    return link_filter.stats()
+
+
+@router.get("/health/db", response_model=DBHealth)
+async def get_db_health():
+    """Состояние предохранителя БД и буфера переходов"""
+    return DBHealth(breaker=db_breaker.stats(), click_spool=spool_stats())
+
+
+async def _resolve_from_cache(short_code: str) -> str:
+    """Разрешение кода по долгоживущей копии записи в кэше, пока БД недоступна"""
+    try:
+        cached = await get_cached_links([short_code], stale=True)
+    except Exception:
+        logger.exception("Link cache unavailable while database is down")
+        cached = {}
+
+    if short_code not in cached:
+        raise DatabaseUnavailable(f"No cached entry for {short_code}")
+
+    original_url, expires_at, _ = cached[short_code]
+    if expires_at and expires_at < datetime.utcnow():
+        raise HTTPException(status_code=410, detail="Link expired")
+    return original_url
+
+
+def _count_click(short_code: str, **kwargs):
+    # Переход учитывается в памяти воркера и периодически сбрасывается в БД
+    record_click(short_code)
+
+
+@router.get("/{short_code}", response_model=Message)
+@cache_response_body(expire=60, after=_count_click)  # Кэшируем готовый ответ на 60 секунд, переходы считаются и при попадании
+async def retrieve_url(short_code: str, db: AsyncSession = Depends(get_db)) -> Message:
+    """Перенаправление на оригинальный URL по короткому коду"""
+    try:
+        url_entry = await db_breaker.call(get_url, db, short_code)
+    except DatabaseUnavailable:
+        # БД недоступна: отвечаем по кэшу ссылок, неизвестные коды получают 503
+        await _resolve_from_cache(short_code)
+    else:
+        if url_entry is None:
+            raise HTTPException(status_code=404, detail="Link not found")
+        # Запоминаем ссылку, чтобы она открывалась и во время сбоя БД
+        try:
+            await cache_links({short_code: (url_entry.original_url, url_entry.expires_at)})
+        except Exception:
+            logger.exception("Failed to cache link %s", short_code)
+
+    return Message(message="Redirect successful")
+
+
+@router.get("/search/", response_model=LinkInfo)
 async def search(original_url: str = Query(...), db: AsyncSession = Depends(get_db)):
     """Поиск короткой ссылки по оригинальному URL"""
     url_entry = await search_url(db, original_url)
     if not url_entry:
         raise HTTPException(status_code=404, detail="URL not found")
-    return {
-        "short_code": url_entry.short_code,
-        "original_url": url_entry.original_url,
-        "expires_at": url_entry.expires_at
-    }
+    return LinkInfo.model_validate(url_entry)
 
 
-@router.get("/popular_links/")
-@cache(expire=3600)  # Кэшируем результат на 1 час
-async def get_popular_links(db: AsyncSession = Depends(get_db)):
+@router.get("/popular_links/", response_model=PopularLinks)
+@cache_response_body(expire=3600)  # Кэшируем готовый ответ на 1 час
+async def get_popular_links(db: AsyncSession = Depends(get_db)) -> PopularLinks:
     """Получение 10 популярных ссылок"""
     popular_links = await fetch_popular_links(db)
-    return {"popular_links": popular_links}
+    return PopularLinks.model_validate({"popular_links": popular_links}, from_attributes=True)
 
 
-@router.get("/{short_code}/stats")
+@router.get("/{short_code}/stats", response_model=LinkStats)
 async def get_stats(short_code: str, db: AsyncSession = Depends(get_db)):
     """Получение статистики по ссылке"""
-    return await get_url_stats(db, short_code)
+    return LinkStats.model_validate(await get_url_stats(db, short_code))
 
 
-@router.put("/{short_code}/project")
+@router.put("/{short_code}/project", response_model=ProjectUpdate)
 async def modify_project(short_code: str, project_name: str, db: AsyncSession = Depends(get_db)):
     """Обновление названия проекта для ссылки"""
-    db_url = await get_url(db, short_code=short_code)
+    db_url = await db_breaker.call(get_url, db, short_code=short_code)
     if not db_url:
         raise HTTPException(status_code=404, detail="URL not found")
 
@@ -193,18 +304,73 @@ async def modify_project(short_code: str, project_name: str, db: AsyncSession =
     if not updated_url:
         raise HTTPException(status_code=404, detail="URL not found")
 
-    return {
-        "short_code": short_code,
-        "project_name": updated_url.project_name
-    }
+    return ProjectUpdate(short_code=short_code, project_name=updated_url.project_name)
 
 
-@router.get("/projects/{project_name}/links")
+@router.get("/projects/{project_name}/links", response_model=List[LinkInfo])
 async def get_project_links(project_name: str, db: AsyncSession = Depends(get_db)):
     """Получение всех ссылок в проекте"""
     links = await get_links_by_project(db, project_name)
     if not links:
         raise HTTPException(status_code=404, detail="No links found for this project")
-    return [{"short_code": link.short_code, "original_url": link.original_url, "expires_at": link.expires_at} for link in links]
-
-
+    return [LinkInfo.model_validate(link) for link in links]
+
+
+# Фоновые задачи (выполняются воркерами Celery)
+MAX_BULK_ITEMS = 10000
+
+
+@router.post("/jobs/bulk_shorten", dependencies=[Depends(require_admin)], response_model=JobStarted)
+async def start_bulk_shorten(request: BulkShortenRequest):
+    """Запуск массового создания коротких ссылок"""
+    if len(request.items) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Too many items. Maximum is {MAX_BULK_ITEMS}.")
+    job = bulk_shorten.delay([item.model_dump() for item in request.items], request.project_name)
+    return JobStarted(job_id=job.id, status=job.status)
+
+
+@router.post("/jobs/export", dependencies=[Depends(require_admin)], response_model=JobStarted)
+async def start_export(project_name: Optional[str] = None):
+    """Запуск выгрузки ссылок в CSV"""
+    job = export_links.delay(project_name)
+    return JobStarted(job_id=job.id, status=job.status)
+
+
+@router.get("/jobs/{job_id}/export", dependencies=[Depends(require_admin)], response_class=FileResponse)
+async def download_export(job_id: str):
+    """Скачивание CSV-файла завершённой выгрузки"""
+    job = celery_app.AsyncResult(job_id)
+    if job.name not in (None, export_links.name) or not job.successful():
+        raise HTTPException(status_code=404, detail="Export not found")
+    path = (job.result or {}).get("path")
+    if not path or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Export not found")
+    return FileResponse(path, media_type="text/csv", filename=f"links-{job_id}.csv")
+
+
+@router.post("/jobs/cleanup", dependencies=[Depends(require_admin)], response_model=JobsStarted)
+async def start_cleanup():
+    """Запуск пакетного удаления истёкших и неиспользуемых ссылок"""
+    jobs = [cleanup_expired.delay(), cleanup_unused.delay()]
+    return JobsStarted(job_ids=[job.id for job in jobs])
+
+
+@router.post("/jobs/stats_rollup", dependencies=[Depends(require_admin)], response_model=JobStarted)
+async def start_stats_rollup():
+    """Запуск пересчёта общей статистики"""
+    job = rollup_stats.delay()
+    return JobStarted(job_id=job.id, status=job.status)
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatus, response_model_exclude_none=True)
+async def get_job_status(job_id: str):
+    """Статус и прогресс фоновой задачи"""
+    job = celery_app.AsyncResult(job_id)
+    response = JobStatus(job_id=job_id, status=job.status)
+    if job.status == "PROGRESS":
+        response.progress = job.info
+    elif job.successful():
+        response.result = job.result
+    elif job.failed():
+        response.error = str(job.result)
+    return response
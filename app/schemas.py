@@ -1,9 +1,20 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
 
 class URLCreate(BaseModel):
     url: str
-    custom_alias: Optional[str] = None
+    # Те же ограничения, что у URLModel.custom_alias: ошибка возвращается до записи в БД
+    custom_alias: Optional[str] = Field(None, min_length=3, max_length=30)
+
+class BulkShortenRequest(BaseModel):
+    items: List[URLCreate]
+    project_name: Optional[str] = None
+
+MAX_RESOLVE_CODES = 1000
+
+class ResolveRequest(BaseModel):
+    codes: List[str] = Field(..., min_length=1, max_length=MAX_RESOLVE_CODES)
 
 class UserBase(BaseModel):
     username: str
@@ -16,4 +27,125 @@ class User(UserBase):
     id: int
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+# Модели ответов
+class Token(BaseModel):
+    access_token: str
+    token_type: str
+
+class Message(BaseModel):
+    message: str
+
+class LinkInfo(BaseModel):
+    short_code: str
+    original_url: str
+    expires_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class ShortenedLink(LinkInfo):
+    project_name: Optional[str] = None
+
+class LinkStats(BaseModel):
+    short_code: str
+    original_url: str
+    created_at: Optional[datetime] = None  # У старых записей столбцы created_at и clicks могут быть NULL
+    clicks: Optional[int] = None
+    last_accessed_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class PopularLink(BaseModel):
+    id: int
+    short_code: str
+    original_url: str
+    custom_alias: Optional[str] = None
+    created_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    clicks: Optional[int] = None
+    last_accessed_at: Optional[datetime] = None
+    project_name: Optional[str] = None
+    owner_id: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+class PopularLinks(BaseModel):
+    popular_links: List[PopularLink]
+
+class ProjectUpdate(BaseModel):
+    short_code: str
+    project_name: Optional[str] = None
+
+class ResolvedLink(BaseModel):
+    short_code: str
+    status: str  # ok / expired / not_found
+    original_url: Optional[str] = None
+    expires_at: Optional[datetime] = None
+
+class ResolveResponse(BaseModel):
+    results: List[ResolvedLink]
+
+class FilterMetrics(BaseModel):
+    enabled: bool
+    ready: bool
+    backend: str
+    memory_bytes: int
+    hashes: int
+    items: int
+    estimated_false_positive_rate: float
+    observed_false_positive_rate: float
+    checks: int
+    rejected: int
+    passed: int
+    false_positives: int
+    rebuilds: int
+    errors: int
+
+class BreakerStats(BaseModel):
+    state: str
+    consecutive_failures: int
+    calls: int
+    failures: int
+    timeouts: int
+    rejected: int
+    opened: int
+
+class ClickSpoolStats(BaseModel):
+    pending_clicks: int
+    pending_links: int
+    max_links: int
+    dropped_clicks: int
+
+class DBHealth(BaseModel):
+    breaker: BreakerStats
+    click_spool: ClickSpoolStats
+
+class LoopLagEvent(BaseModel):
+    at: str
+    blocked_ms: float
+    stack: Optional[str] = None
+
+class LoopLagStats(BaseModel):
+    pid: int
+    threshold_ms: float
+    max_lag_ms: float
+    slow_events: List[LoopLagEvent]
+
+class JobStarted(BaseModel):
+    job_id: str
+    status: str
+
+class JobsStarted(BaseModel):
+    job_ids: List[str]
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str
+    progress: Optional[Dict[str, Any]] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
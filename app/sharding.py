@@ -0,0 +1,137 @@
+"""Распределение ссылок по шардам БД по короткому коду.
+
+Шард определяется консистентным хешированием short_code, поэтому его можно
+вычислить по самому коду без обращения к БД.
+
+Шарды задаются списком «имя=адрес» через запятую (DATABASE_SHARDS). Кольцо
+строится по именам, поэтому смена пароля или хоста шарда не перераспределяет ключи.
+
+Перенос ссылок при изменении списка шардов:
+    python -m app.sharding rebalance OLD_SHARDS NEW_SHARDS
+где OLD_SHARDS и NEW_SHARDS – списки в том же формате.
+"""
+from bisect import bisect
+from typing import List, Tuple
+import asyncio
+import hashlib
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+SHARD_VIRTUAL_NODES = 64  # Виртуальных узлов на шард – сглаживает распределение ключей
+REBALANCE_BATCH_SIZE = 1000
+
+
+def parse_shards(value: str) -> List[Tuple[str, str]]:
+    """Разбор списка шардов «s1=url1,s2=url2» в [(имя, адрес)]"""
+    shards = []
+    for item in value.split(","):
+        if not item:
+            continue
+        name, sep, url = item.partition("=")
+        if not sep or not name or not url:
+            raise ValueError(f"Invalid shard definition: {item!r}. Use name=url.")
+        shards.append((name.strip(), url.strip()))
+    names = [name for name, _ in shards]
+    if len(set(names)) != len(names):
+        raise ValueError("Shard names must be unique.")
+    return shards
+
+
+def _hash(key: str) -> int:
+    # Хеш должен быть одинаковым во всех процессах, поэтому встроенный hash() не подходит
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class ShardRouter:
+    """Кольцо консистентного хеширования: short_code -> номер шарда.
+
+    Узлы кольца строятся по постоянным именам шардов, поэтому при добавлении
+    шарда переезжает только часть ключей, а смена адреса шарда их не затрагивает.
+    """
+
+    def __init__(self, shard_keys: List[str], virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        if not shard_keys:
+            raise ValueError("At least one shard is required.")
+        ring = sorted(
+            (_hash(f"{key}#{node}"), index)
+            for index, key in enumerate(shard_keys)
+            for node in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in ring]
+        self._shards = [index for _, index in ring]
+        self.shard_count = len(shard_keys)
+
+    def shard_for(self, short_code: str) -> int:
+        position = bisect(self._hashes, _hash(short_code)) % len(self._hashes)
+        return self._shards[position]
+
+
+async def rebalance(old_shards: List[Tuple[str, str]], new_shards: List[Tuple[str, str]]):
+    """Перенос ссылок на шарды, назначенные новым кольцом; после сбоя запуск можно повторить"""
+    from sqlalchemy import delete
+    from sqlalchemy.dialects.postgresql import insert
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.future import select
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import NullPool
+    from .models import URLModel
+
+    def session_factory(url):
+        return sessionmaker(bind=create_async_engine(url, poolclass=NullPool), class_=AsyncSession, expire_on_commit=False)
+
+    router = ShardRouter([name for name, _ in new_shards])
+    targets = [session_factory(url) for _, url in new_shards]
+    columns = [column.name for column in URLModel.__table__.columns if column.name != "id"]
+
+    for old_name, old_url in old_shards:
+        moved = 0
+        last_id = 0
+        source = session_factory(old_url)
+        while True:
+            async with source() as db:
+                async with db.begin():
+                    rows = (await db.execute(
+                        select(URLModel.__table__)
+                        .where(URLModel.id > last_id)
+                        .order_by(URLModel.id)
+                        .limit(REBALANCE_BATCH_SIZE)
+                    )).mappings().all()
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+
+            by_target = {}
+            for row in rows:
+                target = router.shard_for(row["short_code"])
+                if new_shards[target][0] != old_name:
+                    by_target.setdefault(target, []).append(row)
+
+            for target, target_rows in by_target.items():
+                # Сначала вставка в новый шард, затем удаление из старого: при сбое ссылка
+                # временно есть в двух местах, а повторный запуск пропускает уже перенесённые
+                async with targets[target]() as db:
+                    async with db.begin():
+                        await db.execute(
+                            insert(URLModel).on_conflict_do_nothing(index_elements=["short_code"]),
+                            [{name: row[name] for name in columns} for row in target_rows]
+                        )
+                async with source() as db:
+                    async with db.begin():
+                        await db.execute(delete(URLModel).where(URLModel.id.in_([row["id"] for row in target_rows])))
+                moved += len(target_rows)
+
+        logger.info("Rebalanced %s: moved %d links", old_name, moved)
+
+
+def main(argv):
+    if len(argv) != 4 or argv[1] != "rebalance":
+        print("Usage: python -m app.sharding rebalance OLD_SHARDS NEW_SHARDS")
+        sys.exit(1)
+    asyncio.run(rebalance(parse_shards(argv[2]), parse_shards(argv[3])))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv)
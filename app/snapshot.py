@@ -0,0 +1,315 @@
+"""Снимок таблицы ссылок для edge-узлов без доступа к БД.
+
+Формат файла снимка (little-endian):
+    заголовок | записи, отсортированные по short_code (в пределах шарда) | хеш-индекс
+Запись: длина кода (u8), длина URL (u32), expires_at в unix time (i64, 0 – бессрочно), код, URL.
+Индекс: таблица смещений записей (u64, 0 – пустая ячейка) с линейным пробированием.
+
+Файл дельты содержит записи в том же формате без индекса; запись с пустым URL означает удаление.
+Дельта строится по потоку изменений links:changes (см. app/outbox.py): в неё попадают
+созданные, изменённые и удалённые после построения снимка ссылки.
+
+Выгрузка: python -m app.snapshot export [PATH]
+Дельта:   python -m app.snapshot delta [PATH]
+"""
+from datetime import datetime
+from dotenv import load_dotenv
+from typing import Dict, Optional, Tuple
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "snapshots/links.snap")
+SNAPSHOT_RELOAD_SECONDS = int(os.getenv("SNAPSHOT_RELOAD_SECONDS", 10))
+EXPORT_CHUNK_SIZE = 10000
+# Запас на расхождение часов узла выгрузки и Redis; повторное применение событий безопасно
+DELTA_CLOCK_SKEW_SECONDS = 60
+
+SNAPSHOT_MAGIC = b"LSNP"
+DELTA_MAGIC = b"LSND"
+FORMAT_VERSION = 1
+
+# magic, версия, количество записей, количество ячеек индекса, время создания, смещение индекса
+HEADER = struct.Struct("<4sHIIqQ")
+# magic, версия, время создания базового снимка, количество записей
+DELTA_HEADER = struct.Struct("<4sHqI")
+RECORD = struct.Struct("<BIq")
+SLOT = struct.Struct("<Q")
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _to_ts(value: Optional[datetime]) -> int:
+    return int((value - _EPOCH).total_seconds()) if value else 0
+
+
+def _from_ts(value: int) -> Optional[datetime]:
+    return datetime.utcfromtimestamp(value) if value else None
+
+
+def pack_record(short_code: str, original_url: str, expires_at: Optional[datetime]) -> bytes:
+    code = short_code.encode("utf-8")
+    url = original_url.encode("utf-8")
+    return RECORD.pack(len(code), len(url), _to_ts(expires_at)) + code + url
+
+
+def _unpack_record(buf, offset: int) -> Tuple[str, str, Optional[datetime], int]:
+    code_len, url_len, expires_ts = RECORD.unpack_from(buf, offset)
+    start = offset + RECORD.size
+    code = bytes(buf[start:start + code_len]).decode("utf-8")
+    url = bytes(buf[start + code_len:start + code_len + url_len]).decode("utf-8")
+    return code, url, _from_ts(expires_ts), start + code_len + url_len
+
+
+def _bucket_count(records: int) -> int:
+    # Степень двойки с заполнением индекса не более 50%
+    count = 1
+    while count < records * 2:
+        count <<= 1
+    return count
+
+
+def _replace_atomically(tmp_path: str, path: str):
+    with open(tmp_path, "rb+") as f:
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+async def export_snapshot(path: str = SNAPSHOT_PATH) -> int:
+    """Потоковая выгрузка таблицы ссылок в новый снимок с атомарной подменой файла"""
+    from sqlalchemy.future import select
+    from .database import shard_sessionmakers
+    from .models import URLModel
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    created_ts = int(time.time())
+    hashes = []
+
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * HEADER.size)  # Заголовок записывается после индекса
+        offset = HEADER.size
+
+        for session_factory in shard_sessionmakers:
+            async with session_factory() as db:
+                async with db.begin():
+                    result = await db.stream(
+                        select(URLModel.short_code, URLModel.original_url, URLModel.expires_at)
+                        .order_by(URLModel.short_code)
+                        .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+                    )
+                    async for partition in result.partitions():
+                        for row in partition:
+                            record = pack_record(row.short_code, row.original_url, row.expires_at)
+                            f.write(record)
+                            hashes.append((zlib.crc32(row.short_code.encode("utf-8")), offset))
+                            offset += len(record)
+
+        buckets = _bucket_count(len(hashes))
+        mask = buckets - 1
+        index = bytearray(buckets * SLOT.size)
+        for code_hash, record_offset in hashes:
+            slot = code_hash & mask
+            while SLOT.unpack_from(index, slot * SLOT.size)[0]:
+                slot = (slot + 1) & mask
+            SLOT.pack_into(index, slot * SLOT.size, record_offset)
+
+        f.write(index)
+        f.seek(0)
+        f.write(HEADER.pack(SNAPSHOT_MAGIC, FORMAT_VERSION, len(hashes), buckets, created_ts, offset))
+
+    _replace_atomically(tmp_path, path)
+    logger.info("Snapshot exported: %d records to %s", len(hashes), path)
+    return len(hashes)
+
+
+def _stream_id(value) -> Tuple[int, int]:
+    if isinstance(value, bytes):
+        value = value.decode("ascii")
+    ms, seq = value.split("-")
+    return int(ms), int(seq)
+
+
+async def export_delta(path: str = SNAPSHOT_PATH) -> int:
+    """Выгрузка изменений ссылок после построения снимка из потока links:changes"""
+    from .cache import redis_client
+    from .outbox import CHANGES_STREAM, EVENT_CREATED, EVENT_UPDATED, EVENT_DELETED
+
+    with open(path, "rb") as f:
+        _, _, _, _, created_ts, _ = HEADER.unpack(f.read(HEADER.size))
+    start = ((created_ts - DELTA_CLOCK_SKEW_SECONDS) * 1000, 0)
+
+    # Поток обрезается по CHANGES_STREAM_MAXLEN; если удалены события после снимка, дельта была бы неполной
+    try:
+        info = await redis_client.xinfo_stream(CHANGES_STREAM)
+    except Exception:
+        info = {}  # Потока ещё нет – изменений не было
+    max_deleted = info.get("max-deleted-entry-id")
+    if max_deleted is not None and _stream_id(max_deleted) >= start:
+        raise RuntimeError("Change stream was trimmed after the snapshot was built, run a full export")
+
+    # Событие с наибольшим id задаёт состояние кода: (url, expires_at) или None для удалённых.
+    # Порядок в потоке не гарантирован: транзакция с меньшим id может зафиксироваться позже
+    changes: Dict[str, Optional[Tuple[str, Optional[datetime]]]] = {}
+    change_ids: Dict[str, int] = {}
+    cursor = f"{start[0]}-{start[1]}"
+    while True:
+        entries = await redis_client.xrange(CHANGES_STREAM, min=cursor, max="+", count=EXPORT_CHUNK_SIZE)
+        for entry_id, fields in entries:
+            event_type = fields[b"type"].decode("utf-8")
+            code = fields[b"code"].decode("utf-8")
+            event_id = int(fields[b"id"])
+            if event_type not in (EVENT_CREATED, EVENT_UPDATED, EVENT_DELETED) or event_id < change_ids.get(code, -1):
+                continue
+            change_ids[code] = event_id
+            if event_type == EVENT_DELETED:
+                changes[code] = None
+            else:
+                expires_at = fields.get(b"expires_at")
+                changes[code] = (
+                    fields[b"url"].decode("utf-8"),
+                    datetime.fromisoformat(expires_at.decode("utf-8")) if expires_at else None
+                )
+        if len(entries) < EXPORT_CHUNK_SIZE:
+            break
+        last_id = entries[-1][0]
+        cursor = "(" + (last_id.decode("ascii") if isinstance(last_id, bytes) else last_id)
+
+    delta_path = f"{path}.delta"
+    tmp_path = f"{delta_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(DELTA_HEADER.pack(DELTA_MAGIC, FORMAT_VERSION, created_ts, len(changes)))
+        for code, entry in changes.items():
+            # Удаление записывается как запись с пустым URL
+            f.write(pack_record(code, *entry) if entry else pack_record(code, "", None))
+
+    _replace_atomically(tmp_path, delta_path)
+    logger.info("Snapshot delta exported: %d records to %s", len(changes), delta_path)
+    return len(changes)
+
+
+class SnapshotResolver:
+    """Поиск ссылок в снимке через mmap без обращения к БД"""
+
+    def __init__(self, path: str = SNAPSHOT_PATH):
+        self.path = path
+        self._file = None
+        self._mm = None
+        self._view = None
+        self._delta: Dict[str, Optional[Tuple[str, Optional[datetime]]]] = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self.records = 0
+        self.created_ts = 0
+
+    def _stat_signature(self):
+        signature = []
+        for file_path in (self.path, f"{self.path}.delta"):
+            try:
+                stat = os.stat(file_path)
+                signature.append((stat.st_ino, stat.st_mtime_ns))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def load(self):
+        """Открытие текущей версии снимка и дельты; старая версия закрывается после подмены"""
+        signature = self._stat_signature()
+        f = open(self.path, "rb")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, records, buckets, created_ts, index_offset = HEADER.unpack_from(mm, 0)
+        if magic != SNAPSHOT_MAGIC or version != FORMAT_VERSION:
+            mm.close()
+            f.close()
+            raise ValueError(f"Unsupported snapshot file: {self.path}")
+
+        delta = self._load_delta(created_ts)
+
+        old = (self._view, self._mm, self._file)
+        self._file, self._mm, self._view = f, mm, memoryview(mm)
+        self._mask = buckets - 1
+        self._index_offset = index_offset
+        self._delta = delta
+        self._signature = signature
+        self.records = records
+        self.created_ts = created_ts
+
+        view, old_mm, old_file = old
+        if view is not None:
+            view.release()
+            old_mm.close()
+            old_file.close()
+        logger.info("Snapshot loaded: %d records, %d delta records", records, len(delta))
+
+    def _load_delta(self, created_ts: int):
+        delta = {}
+        try:
+            with open(f"{self.path}.delta", "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return delta
+
+        magic, version, base_ts, count = DELTA_HEADER.unpack_from(data, 0)
+        if magic != DELTA_MAGIC or version != FORMAT_VERSION or base_ts != created_ts:
+            return delta  # Дельта от другой версии снимка
+
+        offset = DELTA_HEADER.size
+        for _ in range(count):
+            code, url, expires_at, offset = _unpack_record(data, offset)
+            delta[code] = (url, expires_at) if url else None
+        return delta
+
+    def reload_if_changed(self):
+        """Проверка новой версии снимка не чаще раза в SNAPSHOT_RELOAD_SECONDS"""
+        now = time.monotonic()
+        if now - self._checked_at < SNAPSHOT_RELOAD_SECONDS:
+            return
+        self._checked_at = now
+        if self._stat_signature() != self._signature:
+            self.load()
+
+    def lookup(self, short_code: str) -> Optional[Tuple[str, Optional[datetime]]]:
+        """(original_url, expires_at) или None, если кода нет"""
+        if short_code in self._delta:
+            return self._delta[short_code]
+
+        code = short_code.encode("utf-8")
+        view = self._view
+        slot = zlib.crc32(code) & self._mask
+        while True:
+            offset = SLOT.unpack_from(view, self._index_offset + slot * SLOT.size)[0]
+            if not offset:
+                return None
+            code_len, url_len, expires_ts = RECORD.unpack_from(view, offset)
+            start = offset + RECORD.size
+            if code_len == len(code) and view[start:start + code_len] == code:
+                url_start = start + code_len
+                return str(view[url_start:url_start + url_len], "utf-8"), _from_ts(expires_ts)
+            slot = (slot + 1) & self._mask
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else None
+    path = argv[2] if len(argv) > 2 else SNAPSHOT_PATH
+    if command == "export":
+        asyncio.run(export_snapshot(path))
+    elif command == "delta":
+        asyncio.run(export_delta(path))
+    else:
+        print("Usage: python -m app.snapshot export|delta [PATH]")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv)
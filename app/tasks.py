@@ -1,55 +1,72 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from datetime import datetime, timedelta
-from fastapi import Depends
+from sqlalchemy import delete
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 import logging
 from .models import URLModel
-from .database import AsyncSessionLocal
+from .outbox import record_events, EVENT_DELETED
+from .clicks import flush_clicks
+from .bloom import link_filter, BLOOM_ENABLED, BLOOM_REBUILD_HOURS
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# Удаления при очистке пишутся с семплированием (см. LOG_SAMPLE_RATES)
+logger = logging.getLogger("app.cleanup")
 
 N_DAYS_UNUSED = 30  # Количество дней после последнего использования, чтобы удалить ссылку
+CLEANUP_BATCH_SIZE = 1000  # Количество ссылок, удаляемых за одну транзакцию
+CLICKS_FLUSH_SECONDS = 5  # Период сброса накопленных переходов в БД
 
-# Функция для создания новой сессии БД
-async def get_db_session():
-    async with AsyncSessionLocal() as session:
-        yield session
 
-# Задача для удаления устаревших ссылок
-async def delete_expired_links():
-    async for db in get_db_session():
-        current_time = datetime.utcnow()
+async def _delete_in_batches(db: AsyncSession, condition, batch_size: int, reason: str):
+    """Удаляет ссылки, подходящие под условие, пачками по batch_size"""
+    total = 0
+    while True:
         async with db.begin():
-            expired_links = await db.execute(
-                select(URLModel).filter(URLModel.expires_at < current_time)
-            )
-            for link in expired_links.scalars():
-                await db.delete(link)
-                logger.info(f"Expired URL deleted: {link.short_code}")
-        await db.commit()
+            rows = (await db.execute(
+                select(URLModel.id, URLModel.short_code).filter(condition).limit(batch_size)
+            )).all()
+            if not rows:
+                break
+            ids = [row.id for row in rows]
+            await db.execute(delete(URLModel).where(URLModel.id.in_(ids)))
+            await record_events(db, EVENT_DELETED, [row.short_code for row in rows])
+        total += len(ids)
+        logger.info("%s URLs deleted in batch: %d", reason, len(ids))
+        if len(ids) < batch_size:
+            break
+    return total
+
+# Задача для удаления устаревших ссылок
+async def delete_expired_links(db: AsyncSession, batch_size: int = CLEANUP_BATCH_SIZE):
+    current_time = datetime.utcnow()
+    return await _delete_in_batches(
+        db, URLModel.expires_at < current_time, batch_size, "Expired"
+    )
 
 # Задача для удаления неиспользуемых ссылок
-async def delete_unused_links():
-    async for db in get_db_session():
-        threshold_date = datetime.utcnow() - timedelta(days=N_DAYS_UNUSED)
-        async with db.begin():
-            unused_links = await db.execute(
-                select(URLModel).filter(
-                    URLModel.last_used_at != None,  # Исключаем ссылки, по которым не было переходов
-                    URLModel.last_used_at < threshold_date
-                )
-            )
-            for link in unused_links.scalars():
-                await db.delete(link)
-                logger.info(f"Deleted unused URL: {link.short_code}")
-        await db.commit()
-
-# Запуск планировщика задач
+async def delete_unused_links(db: AsyncSession, batch_size: int = CLEANUP_BATCH_SIZE):
+    threshold_date = datetime.utcnow() - timedelta(days=N_DAYS_UNUSED)
+    return await _delete_in_batches(
+        db,
+        # last_accessed_at задаётся при создании, поэтому ссылки без переходов
+        # удаляются через N_DAYS_UNUSED дней после создания
+        URLModel.last_accessed_at < threshold_date,
+        batch_size,
+        "Unused"
+    )
+
+# Запуск планировщика задач.
+# Очистка ссылок выполняется воркерами Celery (см. app/jobs.py),
+# в веб-процессе остаются сброс счётчиков переходов и перестройка фильтра кодов.
 scheduler = AsyncIOScheduler()
 
 def start_scheduler():
-    scheduler.add_job(delete_expired_links, "interval", minutes=60)
-    scheduler.add_job(delete_unused_links, "interval", hours=24)  # Раз в сутки
+    scheduler.add_job(flush_clicks, "interval", seconds=CLICKS_FLUSH_SECONDS)
+    if BLOOM_ENABLED:
+        # Перестройка убирает из фильтра удалённые коды
+        scheduler.add_job(link_filter.rebuild, "interval", hours=BLOOM_REBUILD_HOURS)
     scheduler.start()
+
+def stop_scheduler():
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
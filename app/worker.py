@@ -0,0 +1,14 @@
+from uvicorn.workers import UvicornWorker
+import os
+
+
+class ServiceWorker(UvicornWorker):
+    """Воркер gunicorn с настраиваемым event loop и HTTP-парсером.
+
+    По умолчанию uvicorn сам выбирает uvloop и httptools, если они установлены.
+    """
+    CONFIG_KWARGS = {
+        "loop": os.getenv("UVICORN_LOOP", "auto"),
+        "http": os.getenv("UVICORN_HTTP", "auto"),
+        "lifespan": "on",
+    }
@@ -0,0 +1,62 @@
+"""Сравнение кодировщиков кэша: размер записи и время encode/decode.
+
+Запуск: python -m benchmarks.cache_serialization
+"""
+from datetime import datetime, timedelta
+import timeit
+
+from fastapi_cache.coder import JsonCoder
+
+from app.cache import ResponseBodyCoder, pack_link_entry, unpack_link_entry
+
+N = 20000
+
+REDIRECT_ENTRY = {
+    "original_url": "https://example.com/articles/2025/03/some-long-article-slug?utm_source=newsletter",
+    "expires_at": (datetime(2025, 3, 16) + timedelta(days=30)).isoformat(),
+}
+
+POPULAR_LINKS = {
+    "popular_links": [
+        {
+            "id": i,
+            "short_code": f"abc{i:03d}",
+            "original_url": f"https://example.com/articles/{i}/some-long-article-slug",
+            "custom_alias": None,
+            "created_at": datetime(2025, 3, 16, 12, 0, i).isoformat(),
+            "expires_at": None,
+            "clicks": 1000 - i,
+            "last_accessed_at": datetime(2025, 3, 17, 8, 0, i).isoformat(),
+            "project_name": "promo",
+            "owner_id": None,
+        }
+        for i in range(10)
+    ]
+}
+
+
+def measure(name, encode, decode, value):
+    encoded = encode(value)
+    encode_ns = timeit.timeit(lambda: encode(value), number=N) / N * 1e9
+    decode_ns = timeit.timeit(lambda: decode(encoded), number=N) / N * 1e9
+    print(f"{name:<28} {len(encoded):>8} B {encode_ns:>10.0f} ns {decode_ns:>10.0f} ns")
+
+
+def main():
+    print(f"{'coder':<28} {'size':>10} {'encode':>13} {'decode':>13}")
+
+    for name, value in (("redirect", REDIRECT_ENTRY), ("popular_links", POPULAR_LINKS)):
+        measure(f"json / {name}", JsonCoder.encode, JsonCoder.decode, value)
+        measure(f"orjson body / {name}", ResponseBodyCoder.encode, ResponseBodyCoder.decode, value)
+
+    expires_at = datetime.fromisoformat(REDIRECT_ENTRY["expires_at"])
+    measure(
+        "struct / redirect",
+        lambda value: pack_link_entry(value, expires_at),
+        unpack_link_entry,
+        REDIRECT_ENTRY["original_url"],
+    )
+
+
+if __name__ == "__main__":
+    main()
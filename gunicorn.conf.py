@@ -0,0 +1,46 @@
+# Конфигурация gunicorn для многопроцессного запуска сервиса:
+# gunicorn -c gunicorn.conf.py app.main:app
+import multiprocessing
+import os
+import sys
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+
+# Количество воркеров по числу ядер
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "app.worker.ServiceWorker"
+
+# Приложение импортируется один раз в мастер-процессе до форка воркеров
+preload_app = os.getenv("PRELOAD_APP", "true").lower() == "true"
+
+# Перезапуск воркера после N запросов (с разбросом, чтобы воркеры не рестартовали одновременно)
+max_requests = int(os.getenv("MAX_REQUESTS", 10000))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", 1000))
+
+# Время на завершение текущих запросов и сброс буферов при остановке воркера
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+timeout = int(os.getenv("WORKER_TIMEOUT", 60))
+keepalive = int(os.getenv("KEEPALIVE", 5))
+
+# Общий лимит соединений с БД делится между воркерами
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", 80))
+os.environ.setdefault("DB_POOL_SIZE", str(max(DB_MAX_CONNECTIONS // workers, 2)))
+os.environ.setdefault("DB_MAX_OVERFLOW", "0")
+
+# Фильтр Блума в памяти строится заново в каждом воркере (в том числе после перезапуска
+# по max_requests) и не видит коды, созданные другими воркерами, – по умолчанию общий фильтр в Redis
+if workers > 1 or max_requests > 0:
+    os.environ.setdefault("BLOOM_BACKEND", "redis")
+
+accesslog = None
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    # Соединения из пула мастер-процесса не должны переиспользоваться в воркерах
+    # (edge-режим работает без БД и модуль app.database не загружает)
+    database = sys.modules.get("app.database")
+    if database is not None:
+        for engine in [database.engine, *database.shard_engines]:
+            engine.sync_engine.dispose(close=False)
@@ -0,0 +1,134 @@
+"""Предохранитель БД: отказы имитируются функциями, которые падают или зависают"""
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.breaker import CircuitBreaker, DatabaseUnavailable, CLOSED, OPEN, HALF_OPEN
+
+
+async def db_down():
+    raise ConnectionRefusedError("connection refused")
+
+
+async def db_ok():
+    return "ok"
+
+
+def make_breaker(failures=3, reset=10.0, timeout=0.05):
+    return CircuitBreaker(failures, reset, timeout)
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        with pytest.raises(DatabaseUnavailable):
+            asyncio.run(breaker.call(db_down))
+
+
+def expire_reset_timeout(breaker):
+    breaker.opened_at = time.monotonic() - breaker.reset_timeout - 1
+
+
+def test_opens_after_n_failures():
+    breaker = make_breaker(failures=3)
+    for _ in range(2):
+        with pytest.raises(DatabaseUnavailable):
+            asyncio.run(breaker.call(db_down))
+    assert breaker.state == CLOSED
+
+    with pytest.raises(DatabaseUnavailable):
+        asyncio.run(breaker.call(db_down))
+    assert breaker.state == OPEN
+
+    # Пока предохранитель разомкнут, БД не вызывается
+    calls = []
+
+    async def tracked():
+        calls.append(1)
+
+    with pytest.raises(DatabaseUnavailable):
+        asyncio.run(breaker.call(tracked))
+    assert calls == []
+    assert breaker.metrics["rejected"] == 1
+    assert breaker.metrics["opened"] == 1
+
+
+def test_success_resets_failure_count():
+    breaker = make_breaker(failures=3)
+    for _ in range(2):
+        with pytest.raises(DatabaseUnavailable):
+            asyncio.run(breaker.call(db_down))
+    assert asyncio.run(breaker.call(db_ok)) == "ok"
+    assert breaker.consecutive_failures == 0
+    assert breaker.state == CLOSED
+
+
+def test_half_open_allows_single_probe():
+    breaker = make_breaker(timeout=1.0)
+    open_breaker(breaker)
+    expire_reset_timeout(breaker)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow_probe():
+            await release.wait()
+            return "ok"
+
+        probe = asyncio.create_task(breaker.call(slow_probe))
+        await asyncio.sleep(0)
+        assert breaker.state == HALF_OPEN
+
+        # Второй запрос, пока пробный не завершён, отклоняется
+        with pytest.raises(DatabaseUnavailable):
+            await breaker.call(db_ok)
+
+        release.set()
+        return await probe
+
+    assert asyncio.run(scenario()) == "ok"
+    assert breaker.state == CLOSED
+
+
+def test_failed_probe_reopens():
+    breaker = make_breaker()
+    open_breaker(breaker)
+    expire_reset_timeout(breaker)
+
+    with pytest.raises(DatabaseUnavailable):
+        asyncio.run(breaker.call(db_down))
+    assert breaker.state == OPEN
+    with pytest.raises(DatabaseUnavailable):
+        asyncio.run(breaker.call(db_ok))
+
+
+def test_timeout_counts_as_failure():
+    breaker = make_breaker(failures=1, timeout=0.05)
+
+    async def hanging():
+        await asyncio.sleep(5)
+
+    with pytest.raises(DatabaseUnavailable):
+        asyncio.run(breaker.call(hanging))
+    assert breaker.metrics["timeouts"] == 1
+    assert breaker.consecutive_failures == 1
+    assert breaker.state == OPEN
+
+
+def test_application_error_does_not_close_breaker():
+    breaker = make_breaker()
+    open_breaker(breaker)
+    expire_reset_timeout(breaker)
+
+    # 404 от фильтра Блума без обращения к БД не доказывает, что БД доступна
+    async def not_found():
+        raise HTTPException(status_code=404, detail="URL not found")
+
+    with pytest.raises(HTTPException):
+        asyncio.run(breaker.call(not_found))
+    assert breaker.state == HALF_OPEN
+
+    # Пробный запрос освобождён, следующий запрос снова проверяет БД
+    assert asyncio.run(breaker.call(db_ok)) == "ok"
+    assert breaker.state == CLOSED
@@ -0,0 +1,153 @@
+"""Буфер переходов при недоступной БД и его сохранение в Redis"""
+import asyncio
+
+import pytest
+
+import app.cache
+from app import clicks
+from app.breaker import CircuitBreaker
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.ops = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def hincrby(self, key, field, amount):
+        self.ops.append((self.redis.hincrby, key, field, amount))
+
+    def hgetall(self, key):
+        self.ops.append((self.redis.hgetall, key))
+
+    def delete(self, key):
+        self.ops.append((self.redis.delete, key))
+
+    async def execute(self):
+        return [op(*args) for op, *args in self.ops]
+
+
+class FakeRedis:
+    """Хеши Redis в памяти; значения возвращаются байтами, как в redis-py"""
+
+    def __init__(self):
+        self.hashes = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def hincrby(self, key, field, amount):
+        values = self.hashes.setdefault(key, {})
+        field = field.encode("utf-8")
+        values[field] = values.get(field, 0) + amount
+        return values[field]
+
+    def hgetall(self, key):
+        return {field: str(value).encode() for field, value in self.hashes.get(key, {}).items()}
+
+    def delete(self, key):
+        return 1 if self.hashes.pop(key, None) is not None else 0
+
+
+class FakeDatabase:
+    """Заменяет запись пачки переходов; available=False имитирует отказ соединения"""
+
+    def __init__(self):
+        self.available = True
+        self.clicks = {}
+
+    async def flush_chunk(self, session_factory, counts, accessed):
+        if not self.available:
+            raise ConnectionRefusedError("connection refused")
+        for code, count in counts.items():
+            self.clicks[code] = self.clicks.get(code, 0) + count
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(app.cache, "redis_client", fake)
+    return fake
+
+
+@pytest.fixture
+def db(monkeypatch, redis):
+    fake = FakeDatabase()
+    monkeypatch.setattr(clicks, "_flush_chunk", fake.flush_chunk)
+    monkeypatch.setattr(clicks, "db_breaker", CircuitBreaker(5, 10.0, 1.0))
+    monkeypatch.setattr(clicks, "_flush_lock", None)
+    monkeypatch.setattr(clicks, "dropped_clicks", 0)
+    clicks._pending_clicks.clear()
+    clicks._last_accessed.clear()
+    yield fake
+    clicks._pending_clicks.clear()
+    clicks._last_accessed.clear()
+
+
+def test_spool_is_bounded(db, monkeypatch):
+    monkeypatch.setattr(clicks, "CLICK_SPOOL_MAX_CODES", 2)
+    for code in ("a", "b", "c", "a"):
+        clicks.record_click(code)
+
+    # Новая ссылка сверх лимита отбрасывается, уже учтённые продолжают считаться
+    assert dict(clicks._pending_clicks) == {"a": 2, "b": 1}
+    assert clicks.spool_stats()["dropped_clicks"] == 1
+
+
+def test_clicks_requeued_while_db_unavailable(db):
+    db.available = False
+    for code in ("a", "a", "b"):
+        clicks.record_click(code)
+
+    assert asyncio.run(clicks.flush_clicks()) == 0
+    assert dict(clicks._pending_clicks) == {"a": 2, "b": 1}
+    assert db.clicks == {}
+
+    # После восстановления БД переходы записываются без потерь и без повторов
+    db.available = True
+    clicks.record_click("a")
+    assert asyncio.run(clicks.flush_clicks()) == 2
+    assert db.clicks == {"a": 3, "b": 1}
+    assert clicks.pending_count() == 0
+
+
+def test_flush_does_not_call_db_while_breaker_open(db):
+    db.available = False
+    clicks.record_click("a")
+    for _ in range(clicks.db_breaker.failure_threshold):
+        asyncio.run(clicks.flush_clicks())
+
+    db.available = True
+    assert asyncio.run(clicks.flush_clicks()) == 0
+    assert clicks.db_breaker.metrics["rejected"] >= 1
+    assert dict(clicks._pending_clicks) == {"a": 1}
+
+
+def test_spool_to_redis_and_restore(db, redis):
+    for code in ("a", "a", "b"):
+        clicks.record_click(code)
+
+    # Воркер останавливается, пока БД недоступна
+    asyncio.run(clicks.spool_to_redis())
+    assert clicks.pending_count() == 0
+    assert redis.hashes[clicks.CLICK_SPOOL_REDIS_KEY] == {b"a": 2, b"b": 1}
+
+    # Другой воркер забирает сохранённые переходы при очередном сбросе
+    assert asyncio.run(clicks.flush_clicks()) == 2
+    assert db.clicks == {"a": 2, "b": 1}
+    assert clicks.CLICK_SPOOL_REDIS_KEY not in redis.hashes
+
+
+def test_spool_not_restored_while_breaker_open(db, redis):
+    redis.hincrby(clicks.CLICK_SPOOL_REDIS_KEY, "a", 3)
+    for _ in range(clicks.db_breaker.failure_threshold):
+        clicks.db_breaker.record_failure()
+
+    asyncio.run(clicks.flush_clicks())
+    assert redis.hashes[clicks.CLICK_SPOOL_REDIS_KEY] == {b"a": 3}
+    assert db.clicks == {}
@@ -0,0 +1,86 @@
+"""Восстановление потребителя потока links:changes после ошибок Redis"""
+import asyncio
+
+import pytest
+from redis.exceptions import ConnectionError, ResponseError
+
+import app.cache
+from app import outbox
+
+
+class FakeRedis:
+    """Поток изменений с заранее заданными отказами xgroup_create и xreadgroup"""
+
+    def __init__(self, create_errors, read_results):
+        self.create_errors = list(create_errors)
+        self.read_results = list(read_results)
+        self.created = 0
+        self.acked = []
+
+    async def xgroup_create(self, stream, group, id="$", mkstream=False):
+        self.created += 1
+        if self.create_errors:
+            raise self.create_errors.pop(0)
+
+    async def xreadgroup(self, group, consumer, streams, count=None, block=None):
+        if not self.read_results:
+            raise asyncio.CancelledError()
+        result = self.read_results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def xack(self, stream, group, message_id):
+        self.acked.append(message_id)
+
+
+@pytest.fixture
+def invalidated(monkeypatch):
+    codes = []
+
+    async def invalidate_link(code):
+        codes.append(code)
+
+    async def claim_stale(redis_client, consumer_name):
+        pass
+
+    real_sleep = asyncio.sleep
+    monkeypatch.setattr(app.cache, "invalidate_link", invalidate_link)
+    monkeypatch.setattr(outbox, "_claim_stale", claim_stale)
+    monkeypatch.setattr(outbox.asyncio, "sleep", lambda delay: real_sleep(0))
+    return codes
+
+
+def _run(redis, monkeypatch):
+    monkeypatch.setattr(app.cache, "redis_client", redis)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(outbox.consume_cache_invalidations("web-test"))
+
+
+def _deleted(message_id, code):
+    return [(outbox.CHANGES_STREAM, [(message_id, {b"type": b"deleted", b"code": code.encode()})])]
+
+
+def test_group_created_after_redis_comes_back(invalidated, monkeypatch):
+    redis = FakeRedis([ConnectionError("connection refused")], [_deleted(b"1-0", "abc")])
+    _run(redis, monkeypatch)
+
+    assert redis.created == 2
+    assert invalidated == ["abc"]
+    assert redis.acked == [b"1-0"]
+
+
+def test_existing_group_is_used(invalidated, monkeypatch):
+    redis = FakeRedis([ResponseError("BUSYGROUP Consumer Group name already exists")], [_deleted(b"1-0", "abc")])
+    _run(redis, monkeypatch)
+
+    assert redis.created == 1
+    assert invalidated == ["abc"]
+
+
+def test_group_recreated_after_nogroup(invalidated, monkeypatch):
+    redis = FakeRedis([], [ResponseError("NOGROUP No such key 'links:changes'"), _deleted(b"2-0", "xyz")])
+    _run(redis, monkeypatch)
+
+    assert redis.created == 2
+    assert invalidated == ["xyz"]
@@ -0,0 +1,51 @@
+"""Кэш готовых ответов: ключ без зависимостей запроса и учёт переходов при попадании"""
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+
+from app.cache import CACHE_PREFIX, ResponseBodyCoder, cache_response_body, response_body_key
+
+
+class Session:
+    """Своя сессия на каждый запрос, как у get_db"""
+
+
+def get_db():
+    return Session()
+
+
+def _client():
+    calls, clicks = [], []
+    app = FastAPI()
+
+    @app.get("/links/{short_code}")
+    @cache_response_body(expire=60, after=lambda short_code, **kwargs: clicks.append(short_code))
+    async def retrieve_url(short_code: str, db: Session = Depends(get_db)):
+        calls.append(short_code)
+        return {"message": "Redirect successful"}
+
+    backend = InMemoryBackend()
+    backend._store = {}  # Хранилище InMemoryBackend общее для всех экземпляров
+    FastAPICache.reset()
+    FastAPICache.init(backend, prefix=CACHE_PREFIX, coder=ResponseBodyCoder)
+    return TestClient(app), backend, calls, clicks
+
+
+def test_cached_body_served_across_sessions():
+    client, backend, calls, clicks = _client()
+    responses = [client.get("/links/abc") for _ in range(3)]
+
+    assert [response.json() for response in responses] == [{"message": "Redirect successful"}] * 3
+    assert [response.headers["x-fastapi-cache"] for response in responses] == ["MISS", "HIT", "HIT"]
+    assert calls == ["abc"]
+    assert list(backend._store) == [response_body_key("retrieve_url", {"short_code": "abc"})]
+
+
+def test_clicks_counted_on_cache_hits():
+    client, _, calls, clicks = _client()
+    for code in ("abc", "abc", "xyz", "abc"):
+        client.get(f"/links/{code}")
+
+    assert calls == ["abc", "xyz"]
+    assert clicks == ["abc", "abc", "xyz", "abc"]